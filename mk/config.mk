@@ -26,6 +26,13 @@ SIZE := $(CROSS_PREFIX)size
 CC_AR ?= $(if $(and $(findstring gcc,$(shell $(CC) --version)), $(findstring gcc-ar, $(shell which $(CROSS_PREFIX)gcc-ar))),gcc-ar,ar)
 CC_AR  := $(CROSS_PREFIX)$(CC_AR)
 
+# Optional compiler cache wrapper such as ccache, e.g. COMPILER_CACHE=ccache.
+# It is only applied to compilation, not to linking.
+COMPILER_CACHE ?=
+ifneq ($(COMPILER_CACHE),)
+CC := $(COMPILER_CACHE) $(CC)
+endif
+
 #################
 # Common config #
 #################
@@ -14,6 +14,11 @@ $(BUILD_DIR)/mlkem1024/bin/%: $(CONFIG)
 	$(Q)[ -d $(@D) ] || mkdir -p $(@D)
 	$(LD) $(CFLAGS) -o $@ $(filter %.o,$^) $(LDLIBS)
 
+$(BUILD_DIR)/%.so: $(CONFIG)
+	$(Q)echo "  LD      $@"
+	$(Q)[ -d $(@D) ] || mkdir -p $(@D)
+	$(Q)$(LD) -shared $(CFLAGS) -o $@ $(filter %.o,$^) $(LDLIBS)
+
 $(BUILD_DIR)/%.a: $(CONFIG)
 	$(Q)echo "  AR      $@"
 	$(Q)[ -d $(@D) ] || mkdir -p $(@D)
@@ -82,3 +87,33 @@ $(BUILD_DIR)/mlkem1024/%.S.o: %.S $(CONFIG)
 	$(Q)echo "  AS      $@"
 	$(Q)[ -d $(@D) ] || mkdir -p $(@D)
 	$(Q)$(CC) -c -o $@ $(CFLAGS) $<
+
+$(BUILD_DIR)/mlkem512/pic/%.c.o: %.c $(CONFIG)
+	$(Q)echo "  CC      $@"
+	$(Q)[ -d $(@D) ] || mkdir -p $(@D)
+	$(Q)$(CC) -c -fPIC -o $@ $(CFLAGS) $<
+
+$(BUILD_DIR)/mlkem512/pic/%.S.o: %.S $(CONFIG)
+	$(Q)echo "  AS      $@"
+	$(Q)[ -d $(@D) ] || mkdir -p $(@D)
+	$(Q)$(CC) -c -fPIC -o $@ $(CFLAGS) $<
+
+$(BUILD_DIR)/mlkem768/pic/%.c.o: %.c $(CONFIG)
+	$(Q)echo "  CC      $@"
+	$(Q)[ -d $(@D) ] || mkdir -p $(@D)
+	$(Q)$(CC) -c -fPIC -o $@ $(CFLAGS) $<
+
+$(BUILD_DIR)/mlkem768/pic/%.S.o: %.S $(CONFIG)
+	$(Q)echo "  AS      $@"
+	$(Q)[ -d $(@D) ] || mkdir -p $(@D)
+	$(Q)$(CC) -c -fPIC -o $@ $(CFLAGS) $<
+
+$(BUILD_DIR)/mlkem1024/pic/%.c.o: %.c $(CONFIG)
+	$(Q)echo "  CC      $@"
+	$(Q)[ -d $(@D) ] || mkdir -p $(@D)
+	$(Q)$(CC) -c -fPIC -o $@ $(CFLAGS) $<
+
+$(BUILD_DIR)/mlkem1024/pic/%.S.o: %.S $(CONFIG)
+	$(Q)echo "  AS      $@"
+	$(Q)[ -d $(@D) ] || mkdir -p $(@D)
+	$(Q)$(CC) -c -fPIC -o $@ $(CFLAGS) $<
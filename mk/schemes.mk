@@ -33,6 +33,21 @@ $(BUILD_DIR)/libmlkem1024.a: CFLAGS += -DMLKEM_K=4
 $(foreach scheme,mlkem512 mlkem768 mlkem1024, \
 	$(eval $(call BUILD_LIB,$(scheme))))
 
+# build shared/lib<scheme>.so, a shared library for use from Python via
+# scripts/lib/mlkem_ffi.py. It lives in a separate directory so that
+# -l<scheme> keeps linking the test binaries against the static library.
+define BUILD_SHARED_LIB
+$(BUILD_DIR)/shared/lib$(1).so: $(call MAKE_OBJS,$(BUILD_DIR)/$(1)/pic,$(SOURCES) $(FIPS202_SRCS) test/ffi_mlkem.c $(wildcard test/notrandombytes/*.c))
+endef
+
+$(BUILD_DIR)/shared/libmlkem512.so: CFLAGS += -DMLKEM_K=2
+$(BUILD_DIR)/shared/libmlkem768.so: CFLAGS += -DMLKEM_K=3
+$(BUILD_DIR)/shared/libmlkem1024.so: CFLAGS += -DMLKEM_K=4
+
+# build libmlkem512.so libmlkem768.so libmlkem1024.so
+$(foreach scheme,mlkem512 mlkem768 mlkem1024, \
+	$(eval $(call BUILD_SHARED_LIB,$(scheme))))
+
 # rules for compilation for all tests: mainly linking with mlkem static link library
 define ADD_SOURCE
 $(BUILD_DIR)/$(1)/bin/$(2)$(shell echo $(1) | tr -d -c 0-9): LDLIBS += -L$(BUILD_DIR) -l$(1)
@@ -46,6 +61,10 @@ $(MLKEM512_DIR)/bin/bench_components_mlkem512: CFLAGS += -Itest/hal
 $(MLKEM768_DIR)/bin/bench_components_mlkem768: CFLAGS += -Itest/hal
 $(MLKEM1024_DIR)/bin/bench_components_mlkem1024: CFLAGS += -Itest/hal
 
+$(MLKEM512_DIR)/bin/bench_mlkem512: LDLIBS += -lm -lpthread
+$(MLKEM768_DIR)/bin/bench_mlkem768: LDLIBS += -lm -lpthread
+$(MLKEM1024_DIR)/bin/bench_mlkem1024: LDLIBS += -lm -lpthread
+
 $(MLKEM512_DIR)/bin/bench_mlkem512: $(MLKEM512_DIR)/test/hal/hal.c.o
 $(MLKEM768_DIR)/bin/bench_mlkem768: $(MLKEM768_DIR)/test/hal/hal.c.o
 $(MLKEM1024_DIR)/bin/bench_mlkem1024: $(MLKEM1024_DIR)/test/hal/hal.c.o
@@ -0,0 +1,86 @@
+# Copyright (c) 2024 The mlkem-native project authors
+# SPDX-License-Identifier: Apache-2.0
+
+# ACVP test vector files
+#
+# Streaming access to the internalProjection files in test/acvp_data,
+# shared by test/acvp_client.py and the sharding in shard.py.
+
+import json
+import os
+
+acvp_keygen_json = "acvp_keygen_internalProjection.json"
+acvp_encapDecap_json = "acvp_encapDecap_internalProjection.json"
+
+# internalProjection file of each ACVP mode
+json_files = {"keyGen": acvp_keygen_json, "encapDecap": acvp_encapDecap_json}
+
+
+def iter_test_groups(json_file, chunk_size=1 << 16):
+    """Incrementally parse the test groups of an ACVP internalProjection file
+
+    Only a single test group is held in memory at a time, independent of
+    the size of the file. The top-level fields preceding `testGroups` are
+    expected to be scalars, as is the case for all ACVP vector files."""
+    decoder = json.JSONDecoder()
+    key = '"testGroups"'
+    with open(json_file, "r") as f:
+        buf = ""
+        eof = False
+
+        def read_more(n):
+            nonlocal buf, eof
+            data = f.read(n)
+            eof = data == ""
+            buf += data
+
+        # Skip everything up to the start of the testGroups array
+        while key not in buf:
+            if eof:
+                raise ValueError(f"{json_file}: testGroups not found")
+            buf = buf[-len(key) :]
+            read_more(chunk_size)
+        buf = buf[buf.index(key) + len(key) :]
+        expect = ":["
+        while expect != "":
+            buf = buf.lstrip()
+            if buf == "":
+                if eof:
+                    raise ValueError(f"{json_file}: Unexpected end of file")
+                read_more(chunk_size)
+                continue
+            if buf[0] != expect[0]:
+                raise ValueError(f"{json_file}: Malformed testGroups")
+            buf = buf[1:]
+            expect = expect[1:]
+
+        # Decode one test group at a time. If a group is not yet complete,
+        # read as much again as is buffered, so that re-parsing stays
+        # linear in the size of the group.
+        while True:
+            buf = buf.lstrip(" \t\r\n,")
+            if buf.startswith("]"):
+                return
+            try:
+                (tg, end) = decoder.raw_decode(buf)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                read_more(max(chunk_size, len(buf)))
+                continue
+            yield tg
+            buf = buf[end:]
+
+
+def tc_ids(acvp_dir):
+    """Return {(parameter set, mode): [tcId]} of all test cases in the
+    internalProjection files in `acvp_dir`, with tcIds in ascending order"""
+    ids = {}
+    for mode, fn in json_files.items():
+        for tg in iter_test_groups(os.path.join(acvp_dir, fn)):
+            ids.setdefault((tg["parameterSet"], mode), []).extend(
+                tc["tcId"] for tc in tg["tests"]
+            )
+    for v in ids.values():
+        v.sort()
+    return ids
@@ -0,0 +1,289 @@
+# Copyright (c) 2024 The mlkem-native project authors
+# SPDX-License-Identifier: Apache-2.0
+
+# Benchmark results, see `scripts/tests bench --json`
+#
+# The output of the bench binaries is parsed into one record per
+# parameter set, opt value and primitive or component. Results are tagged
+# with the compiler, CFLAGS, CPU model and backends they were obtained
+# with, so that results from different machines can be told apart.
+#
+# {
+#   "version": 1,
+#   "tags": {"compiler": ..., "cflags": {"opt": ..., "no_opt": ...},
+#            "cpu": ..., "machine": ..., "cycles": ...},
+#   "results": [
+#     {"benchmark": "kem" | "components" | "throughput",
+#      "scheme": "ML-KEM-512", "opt": "opt" | "no_opt", "name": "keypair",
+#      "backend": {...}, "unit": "cycles" | "ns" | "ops/s",
+#      # kem and components only, in cycles, or in ns with CYCLES=NO:
+#      "median": ...,
+#      # throughput only, with one record per number of threads:
+#      "threads": ..., "value": ..., "efficiency": ...,
+#      "config": {"warmup": ..., "iterations": ..., "pinned": ...},
+#      # kem only:
+#      "config": {"warmup": ..., "iterations": ..., "samples": ...},
+#      "percentiles": {"1": ..., ..., "99": ...},
+#      "mean": ..., "stddev": ..., "min": ..., "mad": ...,
+#      # in ns with --calibrate only, see calibrate_cyclecounter():
+#      "cycles_per_unit": ..., "estimated_cycles": ...,
+#      # with --dump-samples only:
+#      "samples": [...]},
+#     ...
+#   ]
+# }
+#
+# Two such files are compared by `scripts/tests bench-compare`, see
+# compare().
+
+import json
+import math
+import os
+import platform
+import re
+import shlex
+import subprocess
+
+VERSION = 1
+
+# Symbols of the namespaced functions of the library, see mlkem/namespace.h
+_ARITH_SYMBOL = re.compile(r"PQCP_MLKEM_NATIVE_MLKEM\d+_(\w+)_indcpa_enc$")
+_FIPS202_SYMBOL = re.compile(r"PQCP_MLKEM_NATIVE_FIPS202_(\w+)_sha3_256$")
+
+_UNIT = re.compile(r"unit (\w+)(?:, ([\d.]+) estimated cycles per)?")
+_CONFIG = re.compile(r"warmup (\d+), iterations (\d+), samples (\d+)")
+_COMPONENT = re.compile(r"(.*) (cycles|ns)=(\d+)$")
+_THROUGHPUT_CONFIG = re.compile(r"warmup (\d+), iterations (\d+) per thread(, pinned)?")
+
+
+def parse_kem(output):
+    """Parse the output of bench_mlkem{lvl} into a list of
+    (primitive, result)"""
+    results = {}
+    unit = {"unit": "cycles"}
+    config = None
+    percentiles = None
+    statistics = None
+    for line in output.splitlines():
+        m = _UNIT.match(line.strip())
+        if m is not None:
+            unit = {"unit": m.group(1)}
+            if m.group(2) is not None:
+                unit["cycles_per_unit"] = float(m.group(2))
+            continue
+        m = _CONFIG.match(line.strip())
+        if m is not None:
+            config = dict(
+                zip(["warmup", "iterations", "samples"], map(int, m.groups()))
+            )
+            continue
+        fields = line.split()
+        if len(fields) == 0:
+            continue
+        if fields[0] == "percentile":
+            percentiles = fields[1:]
+        elif fields[0] == "statistic":
+            statistics = fields[1:]
+        elif "=" in line:
+            # keypair {unit} = X, or keypair est. cycles = X, see -c
+            (name, value) = line.split("=")
+            r = results.setdefault(name.split()[0], {})
+            if name.split()[1] == "est.":
+                r["estimated_cycles"] = int(value)
+                continue
+            r.update(unit)
+            r["median"] = int(value)
+            if config is not None:
+                r["config"] = config
+        elif len(fields) < 2:
+            continue
+        elif fields[1] == "percentiles:":
+            results[fields[0]]["percentiles"] = {
+                p: int(v) for p, v in zip(percentiles, fields[2:])
+            }
+        elif fields[1] == "samples:":
+            results[fields[0]]["samples"] = [int(v) for v in fields[2:]]
+        elif fields[1] == "statistics:":
+            for k, v in zip(statistics, fields[2:]):
+                k = k.lower()
+                if k != "median":
+                    results[fields[0]][k] = float(v) if "." in v else int(v)
+    return list(results.items())
+
+
+def parse_components(output):
+    """Parse the output of bench_components_mlkem{lvl} into a list of
+    (component, result)"""
+    results = {}
+    for line in output.splitlines():
+        # txt {unit}=X
+        m = _COMPONENT.match(line.strip())
+        if m is not None:
+            results[m.group(1)] = {"unit": m.group(2), "median": int(m.group(3))}
+    return list(results.items())
+
+
+def parse_throughput(output):
+    """Parse the output of `bench_mlkem{lvl} -t` into a list of
+    (primitive, result), with a result per number of threads"""
+    results = []
+    config = None
+    names = None
+    for line in output.splitlines():
+        m = _THROUGHPUT_CONFIG.match(line.strip())
+        if m is not None:
+            config = {
+                "warmup": int(m.group(1)),
+                "iterations": int(m.group(2)),
+                "pinned": m.group(3) is not None,
+            }
+            continue
+        fields = line.split()
+        if len(fields) == 0:
+            continue
+        if fields[0] == "threads":
+            # threads keypair ops/s eff. encaps ops/s eff. ...
+            names = fields[1::3]
+            continue
+        threads = int(fields[0])
+        for i, name in enumerate(names):
+            results.append(
+                (
+                    name,
+                    {
+                        "threads": threads,
+                        "value": float(fields[1 + 2 * i]),
+                        "efficiency": float(fields[2 + 2 * i].rstrip("%")) / 100,
+                        "config": config,
+                    },
+                )
+            )
+    return results
+
+
+def backends(bin, cross_prefix=""):
+    """Names of the arithmetic and FIPS202 backends linked into `bin`"""
+    p = subprocess.run(
+        shlex.split(f"{cross_prefix}nm") + ["--defined-only", bin],
+        capture_output=True,
+        universal_newlines=True,
+    )
+    backend = {"arith": None, "fips202": None}
+    for line in p.stdout.splitlines():
+        symbol = line.split()[-1]
+        for k, r in [("arith", _ARITH_SYMBOL), ("fips202", _FIPS202_SYMBOL)]:
+            m = r.match(symbol)
+            if m is not None:
+                backend[k] = m.group(1)
+    return backend
+
+
+def cpu_model():
+    """Best-effort description of the CPU of this machine"""
+    if platform.system() == "Darwin":
+        p = subprocess.run(
+            ["sysctl", "-n", "machdep.cpu.brand_string"],
+            capture_output=True,
+            universal_newlines=True,
+        )
+        if p.returncode == 0 and p.stdout.strip():
+            return p.stdout.strip()
+    if os.path.isfile("/proc/cpuinfo"):
+        with open("/proc/cpuinfo", "r") as f:
+            info = dict(
+                [x.strip() for x in line.split(":", 1)]
+                for line in f.read().splitlines()
+                if ":" in line
+            )
+        # x86_64, and AArch64 with the CPU implementer and part number
+        if "model name" in info:
+            return info["model name"]
+        if "CPU part" in info:
+            return f"implementer {info.get('CPU implementer')} part {info['CPU part']}"
+    return platform.processor() or platform.machine()
+
+
+def compiler_version(cc):
+    p = subprocess.run(
+        shlex.split(cc) + ["--version"], capture_output=True, universal_newlines=True
+    )
+    return p.stdout.splitlines()[0] if p.returncode == 0 and p.stdout else cc
+
+
+def write(fn, tags, results):
+    with open(fn, "w") as f:
+        json.dump({"version": VERSION, "tags": tags, "results": results}, f, indent=2)
+
+
+def mann_whitney(xs, ys):
+    """One-sided Mann-Whitney U test of whether the values of `ys` tend to
+    be larger than those of `xs`. Returns the p-value, using the normal
+    approximation with tie and continuity correction."""
+    (n1, n2) = (len(xs), len(ys))
+    values = sorted([(v, 0) for v in xs] + [(v, 1) for v in ys])
+    n = n1 + n2
+
+    # Sum of the ranks of ys, with ties getting the average of their ranks
+    rank_sum = 0.0
+    ties = 0.0
+    i = 0
+    while i < n:
+        j = i
+        while j < n and values[j][0] == values[i][0]:
+            j += 1
+        rank = (i + j + 1) / 2
+        rank_sum += rank * sum(1 for _, k in values[i:j] if k == 1)
+        ties += (j - i) ** 3 - (j - i)
+        i = j
+
+    u = rank_sum - n2 * (n2 + 1) / 2
+    mean = n1 * n2 / 2
+    var = n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1)))
+    if var <= 0:
+        return 1.0
+    z = (u - mean - 0.5) / math.sqrt(var)
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def _key(r):
+    return (r["benchmark"], r["scheme"], r["opt"], r["name"])
+
+
+def compare(baseline, current, threshold, alpha):
+    """Compare the results of two files written by `bench --json`
+
+    For every record present in both, the relative change of the median
+    is computed. A change of more than `threshold` is significant if the
+    samples of both records are known, see --dump-samples, and a
+    Mann-Whitney U test in the direction of the change yields a p-value
+    below `alpha`; without samples, the change alone decides. Returns a
+    list of (record key, baseline median, current median, change, p-value
+    or None, verdict), where verdict is one of "regression",
+    "improvement" and "unchanged"."""
+    base = {_key(r): r for r in baseline["results"]}
+    rows = []
+    for r in current["results"]:
+        b = base.get(_key(r))
+        # Only latencies are compared, not throughput
+        if b is None or b["unit"] != r["unit"] or "median" not in r:
+            continue
+        change = r["median"] / b["median"] - 1 if b["median"] else 0.0
+        p = None
+        if "samples" in b and "samples" in r:
+            if change >= 0:
+                p = mann_whitney(b["samples"], r["samples"])
+            else:
+                p = mann_whitney(r["samples"], b["samples"])
+        verdict = "unchanged"
+        if abs(change) > threshold and (p is None or p < alpha):
+            verdict = "regression" if change > 0 else "improvement"
+        rows.append((_key(r), b["median"], r["median"], change, p, verdict))
+    return rows
+
+
+def load(fn):
+    with open(fn, "r") as f:
+        results = json.load(f)
+    if not isinstance(results, dict) or results.get("version") != VERSION:
+        raise ValueError(f"{fn} is not a file written by `bench --json`")
+    return results
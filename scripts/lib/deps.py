@@ -0,0 +1,154 @@
+# Copyright (c) 2024 The mlkem-native project authors
+# SPDX-License-Identifier: Apache-2.0
+
+# Dependency-aware test selection, see `scripts/tests --changed-since`
+#
+# The prerequisites of a binary are taken from make's database
+# (`make -pnq`), and those of every object from the depfile written next
+# to it by -MMD. A binary is affected by a change if one of its objects
+# depends on a changed file. Objects without any defined symbols other
+# than the `empty_cu_*` placeholders, such as the aarch64 backend compiled
+# on x86_64, are ignored: their sources are preprocessed away, so changing
+# them does not change the binary.
+
+import os
+import re
+import shlex
+import subprocess
+
+# Changes to the build system may affect any binary
+BUILD_INPUTS = ["Makefile", "mk/"]
+
+# Build outputs, which are not inputs even if they are not ignored by git
+BUILD_OUTPUTS = ["test/build/"]
+
+# Inputs of the test types other than their binaries. Changes to these
+# require rerunning the tests, but not rebuilding anything.
+TEST_INPUTS = {
+    "mlkem": ["META.json"],
+    "kat": ["META.json"],
+    "nistkat": ["META.json"],
+    "acvp": ["test/acvp_client.py", "test/acvp_store.py", "test/acvp_data/"],
+}
+
+# Target-specific variable assignments in the output of `make -p`
+_ASSIGNMENT = re.compile(r"^\S+:\s*\S+\s*(\+|:|::|\?|!)?=")
+
+
+def matches(fn, inputs):
+    """Whether `fn` is one of `inputs`, or below one of its directories"""
+    return any(fn == i or (i.endswith("/") and fn.startswith(i)) for i in inputs)
+
+
+def changed_files(rev):
+    """Files changed in the working tree since the git revision `rev`,
+    including untracked files, relative to the top-level directory"""
+    top = subprocess.run(
+        ["git", "rev-parse", "--show-toplevel"],
+        capture_output=True,
+        universal_newlines=True,
+        check=True,
+    ).stdout.strip()
+    changed = set()
+    for args in [
+        ["git", "diff", "--name-only", rev],
+        ["git", "ls-files", "--others", "--exclude-standard", "--full-name"],
+    ]:
+        p = subprocess.run(
+            args, cwd=top, capture_output=True, universal_newlines=True, check=True
+        )
+        changed.update(
+            l for l in p.stdout.splitlines() if l and not matches(l, BUILD_OUTPUTS)
+        )
+    return changed
+
+
+def parse_depfile(fn):
+    """Prerequisites of the target of a depfile written by -MMD"""
+    with open(fn, "r") as f:
+        text = f.read().replace("\\\n", " ")
+    (_, _, deps) = text.partition(": ")
+    return [os.path.normpath(d) for d in deps.split()]
+
+
+class DepGraph:
+    """Prerequisites of a set of binaries in a single build root
+
+    - make_vars: Make variables selecting the build root and configuration
+    - bins: Paths of the binaries
+    - cross_prefix: Prefix of the binutils used to inspect objects"""
+
+    def __init__(self, make_vars, bins, cross_prefix=""):
+        self.bins = bins
+        self.nm = f"{cross_prefix}nm"
+        self.prereqs = {}
+        self._empty = {}
+
+        p = subprocess.run(
+            ["make", "-pnq"] + make_vars + bins,
+            capture_output=True,
+            universal_newlines=True,
+        )
+        for l in p.stdout.splitlines():
+            if l.startswith(("#", "\t")) or _ASSIGNMENT.match(l):
+                continue
+            (target, sep, deps) = l.partition(":")
+            if sep and not target.startswith(".") and " " not in target:
+                self.prereqs.setdefault(os.path.normpath(target), []).extend(
+                    os.path.normpath(d) for d in deps.split()
+                )
+
+    def objects(self, target):
+        """Objects of a binary or library, or None if unknown"""
+        if target not in self.prereqs:
+            return None
+        objs = []
+        for d in self.prereqs[target]:
+            if d.endswith(".o"):
+                objs.append(d)
+            elif d.endswith(".a"):
+                lib = self.objects(d)
+                if lib is None:
+                    return None
+                objs += lib
+        return objs
+
+    def _find_empty(self, objs):
+        """Record which of `objs` do not define any symbols, other than
+        the placeholders of empty compilation units"""
+        objs = [o for o in objs if o not in self._empty]
+        if len(objs) == 0:
+            return
+        p = subprocess.run(
+            shlex.split(self.nm) + ["-A", "--defined-only"] + objs,
+            capture_output=True,
+            universal_newlines=True,
+        )
+        defined = {
+            l.split(":")[0]
+            for l in p.stdout.splitlines()
+            if "empty_cu_" not in l.split()[-1]
+        }
+        for o in objs:
+            self._empty[o] = o not in defined
+
+    def affected(self, bin, changed):
+        """Whether the binary `bin` is affected by any of the files in
+        `changed`. Binaries which were not built yet, or whose depfiles
+        are missing, are always affected."""
+        if any(matches(fn, BUILD_INPUTS) for fn in changed):
+            return True
+        objs = self.objects(bin)
+        if objs is None or not os.path.isfile(bin):
+            return True
+
+        candidates = []
+        for o in objs:
+            depfile = o[: -len(".o")] + ".d"
+            if not os.path.isfile(o) or not os.path.isfile(depfile):
+                return True
+            if any(d in changed for d in parse_depfile(depfile)):
+                candidates.append(o)
+
+        self._find_empty(candidates)
+        return any(not self._empty[o] for o in candidates)
@@ -0,0 +1,96 @@
+# Copyright (c) 2024 The mlkem-native project authors
+# SPDX-License-Identifier: Apache-2.0
+
+# In-process binding to mlkem-native via ctypes
+#
+# Loads the shared libraries test/build/shared/libmlkem{512,768,1024}.so built by
+# `make shared_lib`, and exposes the derandomized KEM API over bytes-like
+# objects. See test/ffi_mlkem.c for the exported entry points.
+
+import ctypes
+import os
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PARAMETER_SETS = {"ML-KEM-512": 512, "ML-KEM-768": 768, "ML-KEM-1024": 1024}
+
+
+def lib_path(level, build_dir=None):
+    if build_dir is None:
+        build_dir = os.path.join(ROOT, "test", "build")
+    return os.path.join(build_dir, "shared", f"libmlkem{level}.so")
+
+
+class MLKEM:
+    """Binding to the shared library of a single parameter set
+
+    The library does not hold any state, so instances can be shared
+    between threads. ctypes releases the GIL during calls."""
+
+    def __init__(self, parameter_set, build_dir=None):
+        self.parameter_set = parameter_set
+        self.lib = ctypes.CDLL(lib_path(PARAMETER_SETS[parameter_set], build_dir))
+
+        for f in ["publickeybytes", "secretkeybytes", "ciphertextbytes", "bytes"]:
+            getattr(self.lib, f"mlkem_ffi_{f}").restype = ctypes.c_size_t
+        self.publickeybytes = self.lib.mlkem_ffi_publickeybytes()
+        self.secretkeybytes = self.lib.mlkem_ffi_secretkeybytes()
+        self.ciphertextbytes = self.lib.mlkem_ffi_ciphertextbytes()
+        self.bytes = self.lib.mlkem_ffi_bytes()
+
+        p = ctypes.c_char_p
+        self.lib.mlkem_ffi_keypair_derand.argtypes = [p, p, p]
+        self.lib.mlkem_ffi_enc_derand.argtypes = [p, p, p, p]
+        self.lib.mlkem_ffi_dec.argtypes = [p, p, p]
+        for f in ["keypair_derand", "enc_derand", "dec"]:
+            getattr(self.lib, f"mlkem_ffi_{f}").restype = ctypes.c_int
+
+    @staticmethod
+    def _input(name, buf, length):
+        """Convert a bytes-like input to bytes, checking its length"""
+        buf = bytes(buf)
+        if len(buf) != length:
+            raise ValueError(f"{name}: expected {length} bytes, got {len(buf)}")
+        return buf
+
+    def crypto_kem_keypair_derand(self, coins):
+        """Returns (pk, sk) for 64 bytes of coins (d || z)"""
+        coins = self._input("coins", coins, 64)
+        pk = ctypes.create_string_buffer(self.publickeybytes)
+        sk = ctypes.create_string_buffer(self.secretkeybytes)
+        if self.lib.mlkem_ffi_keypair_derand(pk, sk, coins) != 0:
+            raise RuntimeError("crypto_kem_keypair_derand failed")
+        return (pk.raw, sk.raw)
+
+    def crypto_kem_enc_derand(self, pk, coins):
+        """Returns (ct, ss) for a public key and 32 bytes of coins"""
+        pk = self._input("pk", pk, self.publickeybytes)
+        coins = self._input("coins", coins, 32)
+        ct = ctypes.create_string_buffer(self.ciphertextbytes)
+        ss = ctypes.create_string_buffer(self.bytes)
+        if self.lib.mlkem_ffi_enc_derand(ct, ss, pk, coins) != 0:
+            raise RuntimeError("crypto_kem_enc_derand failed")
+        return (ct.raw, ss.raw)
+
+    def crypto_kem_dec(self, ct, sk):
+        """Returns the shared secret for a ciphertext and secret key"""
+        ct = self._input("ct", ct, self.ciphertextbytes)
+        sk = self._input("sk", sk, self.secretkeybytes)
+        ss = ctypes.create_string_buffer(self.bytes)
+        if self.lib.mlkem_ffi_dec(ss, ct, sk) != 0:
+            raise RuntimeError("crypto_kem_dec failed")
+        return ss.raw
+
+
+_libs = {}
+_libs_lock = threading.Lock()
+
+
+def load(parameter_set, build_dir=None):
+    """Return the (cached) binding for a parameter set"""
+    with _libs_lock:
+        key = (parameter_set, build_dir)
+        if key not in _libs:
+            _libs[key] = MLKEM(parameter_set, build_dir)
+        return _libs[key]
@@ -6,29 +6,105 @@ import os
 import sys
 import io
 import logging
+import shlex
 import subprocess
+import tempfile
+import time
+import atexit
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
 from functools import reduce, partial
 from util import (
     TEST_TYPES,
     SCHEME,
     sha256sum,
+    sha256file,
+    sha256stream,
+    KATDigests,
     parse_meta,
+    path,
+    build_dir,
+    ResultCache,
     config_logger,
     github_summary,
     logger,
+    tracer,
+    report,
+    summary,
 )
+from deps import DepGraph, TEST_INPUTS, changed_files, matches
+from watch import watcher
+import bench
+from shard import Unit, acvp_ranges, load_timings, parse_shard, partition
 import json
 
 gh_env = os.environ.get("GITHUB_ENV")
 
 
+def dict2str(dict):
+    s = ""
+    for k, v in dict.items():
+        s += f"{k}={v} "
+    return s
+
+
+def compiler_cache_stats(compiler_cache):
+    """Return the (hits, misses) counters of a ccache-style compiler cache,
+    or None if it has no statistics in the format of `ccache --print-stats`"""
+    if not compiler_cache:
+        return None
+    try:
+        p = subprocess.run(
+            shlex.split(compiler_cache) + ["--print-stats"],
+            capture_output=True,
+            universal_newlines=True,
+        )
+    except OSError:
+        return None
+    if p.returncode != 0:
+        return None
+
+    stats = {}
+    for l in p.stdout.splitlines():
+        (k, _, v) = l.partition("\t")
+        if v.strip().isdigit():
+            stats[k] = int(v)
+    hits = stats.get("direct_cache_hit", 0) + stats.get("preprocessed_cache_hit", 0)
+    return (hits, stats.get("cache_miss", 0))
+
+
+def log_compiler_cache_stats(log, before, after):
+    """Log the compiler cache hits and misses between two snapshots of
+    compiler_cache_stats()"""
+    if before is None or after is None:
+        return
+    hits = after[0] - before[0]
+    misses = after[1] - before[1]
+    rate = f" ({100 * hits // (hits + misses)}% hit rate)" if hits + misses else ""
+    log.info(f"compiler cache: {hits} hits, {misses} misses{rate}")
+
+
 class CompileOptions(object):
 
-    def __init__(self, cross_prefix, cflags, auto, verbose):
+    def __init__(
+        self,
+        cross_prefix,
+        cflags,
+        auto,
+        verbose,
+        jobs=1,
+        compiler_cache=None,
+        keep_going=False,
+        build_dir=None,
+    ):
         self.cross_prefix = cross_prefix
         self.cflags = cflags
         self.auto = auto
         self.verbose = verbose
+        self.jobs = jobs
+        self.compiler_cache = compiler_cache
+        self.keep_going = keep_going
+        self.build_dir = build_dir
 
     def compile_mode(self):
         return "Cross" if self.cross_prefix else "Native"
@@ -46,78 +122,79 @@ class Options(object):
         self.exec_wrapper = ""
         self.run_as_root = ""
         self.k = "ALL"
+        self.jobs = 1
+        self.compiler_cache = None
+        self.keep_going = False
+        self.kat_output = None
+        self.trace = None
+        self.report = None
+        self.junit = None
+        self.changed_since = None
+        self.shard = None
+        self.timings = None
+        self.use_cache = False
+        self.cache_file = path("test/build/test_cache.json")
+        # Build root of both opt and no_opt, instead of build_dir(opt)
+        self.build_dir = None
 
 
 class Base:
 
-    def __init__(self, test_type: TEST_TYPES, copts: CompileOptions, opt):
+    def __init__(self, test_type: TEST_TYPES, copts: CompileOptions, opt, cache=None):
         self.test_type = test_type
         self.cross_prefix = copts.cross_prefix
         self.cflags = copts.cflags
         self.auto = copts.auto
         self.verbose = copts.verbose
+        self.jobs = copts.jobs
+        self.compiler_cache = copts.compiler_cache
+        self.keep_going = copts.keep_going
+        # Binaries which failed to be rebuilt, see Tests._compile
+        self.stale = set()
         self.opt = opt
+        self.build_dir = copts.build_dir if copts.build_dir else build_dir(opt)
         self.compile_mode = copts.compile_mode()
         self.opt_label = "opt" if self.opt else "no_opt"
+        self.cache = cache
         self.i = 0
 
-    def compile_schemes(
-        self,
-        extra_make_envs=None,
-        extra_make_args=None,
-    ):
-        """compile or cross compile with some extra environment variables and makefile arguments"""
-        if extra_make_envs is None:
-            extra_make_envs = {}
-        if extra_make_args is None:
-            extra_make_args = []
-
-        if gh_env is not None:
-            print(
-                f"::group::compile {self.compile_mode} {self.opt_label} {self.test_type.desc()}"
-            )
-
-        log = logger(self.test_type, "Compile", self.cross_prefix, self.opt)
-
-        def dict2str(dict):
-            s = ""
-            for k, v in dict.items():
-                s += f"{k}={v} "
-            return s
-
-        extra_make_args = extra_make_args + list(
-            set([f"OPT={int(self.opt)}", f"AUTO={int(self.auto)}"])
-            - set(extra_make_args)
-        )
-
-        args = [
-            "make",
-            f"CROSS_PREFIX={self.cross_prefix}",
-            f"{self.test_type.make_target()}",
-        ] + extra_make_args
-
+    def make_variables(self, names, extra_make_args=None):
+        """Values of the make variables `names` in the build configuration"""
         env = os.environ.copy()
         if self.cflags is not None:
             env["CFLAGS"] = self.cflags
-
-        env.update(extra_make_envs)
-
-        log.info(dict2str(extra_make_envs) + " ".join(args))
-
+        rule = "print-variables: ; " + "".join(f"$(info $({n}))" for n in names) + "@:"
         p = subprocess.run(
-            args,
-            stdout=subprocess.DEVNULL if not self.verbose else None,
+            ["make", "-s", "--no-print-directory"]
+            + self.make_vars(extra_make_args)
+            + [f"--eval={rule}", "print-variables"],
+            capture_output=True,
+            universal_newlines=True,
             env=env,
         )
+        return p.stdout.splitlines()[-len(names) :]
 
-        if p.returncode != 0:
-            log.error(f"make failed: {p.returncode}")
-
-        if gh_env is not None:
-            print(f"::endgroup::")
+    def make_vars(self, extra_make_args=None):
+        """Make variables selecting the build configuration and build root"""
+        if extra_make_args is None:
+            extra_make_args = []
 
-        if p.returncode != 0:
-            sys.exit(1)
+        cache = [f"COMPILER_CACHE={self.compiler_cache}"] if self.compiler_cache else []
+        return (
+            [f"CROSS_PREFIX={self.cross_prefix}"]
+            + cache
+            + extra_make_args
+            + list(
+                set(
+                    [
+                        f"OPT={int(self.opt)}",
+                        f"AUTO={int(self.auto)}",
+                        f"BUILD_DIR={self.build_dir}",
+                    ]
+                )
+                - set(extra_make_args)
+            )
+        )
 
     def run_scheme(
         self,
@@ -125,6 +202,10 @@ class Base:
         check_proc=None,
         cmd_prefix=None,
         extra_args=None,
+        vectors=None,
+        hash_output=False,
+        tee_dir=None,
+        output_sink=None,
     ):
         """Run the binary in all different ways
 
@@ -135,70 +216,159 @@ class Base:
             of the test run with.
         - cmd_prefix: Command prefix; array of strings, or None
         - extra_args: Extra arguments; array of strings, or None
+        - vectors: Digest of the test vectors checked by check_proc, or None.
+            Used to look up and record results in the result cache.
+        - hash_output: If set, the output is hashed while it is produced
+            instead of being buffered, and check_proc is passed the hex
+            SHA-256 digest of the output instead of the output itself.
+        - tee_dir: Directory to write a copy of the output to, or None.
+            Only used with hash_output.
+        - output_sink: Object with a `write` method to pass the output
+            to while hashing it, or None. Only used with hash_output.
         """
-        if cmd_prefix is None:
-            cmd_prefix = []
-        if extra_args is None:
-            extra_args = []
-
-        log = logger(self.test_type, scheme, self.cross_prefix, self.opt, self.i)
-        self.i += 1
-
-        bin = self.test_type.bin_path(scheme)
-        if not os.path.isfile(bin):
-            log.error(f"{bin} does not exists")
-            sys.exit(1)
-
-        cmd = cmd_prefix + [f"{bin}"] + extra_args
+        with tracer.span(
+            "run_scheme",
+            "run",
+            test=self.test_type.desc(),
+            scheme=scheme,
+            opt=self.opt_label,
+        ):
+            if cmd_prefix is None:
+                cmd_prefix = []
+            if extra_args is None:
+                extra_args = []
+
+            log = logger(self.test_type, scheme, self.cross_prefix, self.opt, self.i)
+            self.i += 1
+
+            bin = self.test_type.bin_path(scheme, self.build_dir)
+            if not os.path.isfile(bin) or bin in self.stale:
+                msg = (
+                    f"{bin} could not be rebuilt"
+                    if bin in self.stale
+                    else f"{bin} does not exists"
+                )
+                log.error(msg)
+                self.report(scheme, "fail", message=msg)
+                if self.keep_going and check_proc is not None:
+                    return True
+                sys.exit(1)
+
+            cache_key = None
+            if (
+                self.cache is not None
+                and check_proc is not None
+                and vectors is not None
+            ):
+                cache_key = self.cache.key(bin, self.test_type, vectors)
+                if self.cache.passed(cache_key):
+                    log.info(f"passed (cached)")
+                    self.report(scheme, "pass", bin=bin, cached=True)
+                    return False
+
+            cmd = cmd_prefix + [f"{bin}"] + extra_args
+
+            log.debug(" ".join(cmd))
+
+            start = time.perf_counter()
+            with tracer.span("execute", "run", cmd=" ".join(cmd)):
+                if hash_output:
+                    p = self._run_hashed(cmd, tee_dir, output_sink)
+                else:
+                    p = subprocess.run(
+                        cmd,
+                        capture_output=True,
+                        universal_newlines=False,
+                    )
+
+            duration = time.perf_counter() - start
+
+            result = None
+            status = "pass"
+            err = None
+
+            if p.returncode != 0:
+                log.error(
+                    f"Running '{cmd}' failed: {p.returncode} {p.stderr.decode()}",
+                )
+                status = "fail"
+                err = f"exit code {p.returncode}"
+            elif check_proc is not None:
+                with tracer.span("check", "run"):
+                    result, err = check_proc(scheme, p.stdout)
+                if self.cache is not None:
+                    self.cache.record(cache_key, not result)
+                if result:
+                    log.error(f"{err}")
+                    status = "fail"
+                else:
+                    log.info(f"passed")
+            else:
+                log.info(f"\n{p.stdout.decode()}")
+                result = p.stdout.decode()
 
-        log.debug(" ".join(cmd))
+            self.report(
+                scheme,
+                status,
+                duration=duration,
+                bin=bin,
+                stderr=p.stderr,
+                message=err or None,
+            )
 
-        p = subprocess.run(
-            cmd,
-            capture_output=True,
-            universal_newlines=False,
+            if p.returncode != 0:
+                if self.keep_going and check_proc is not None:
+                    return True
+                exit(p.returncode)
+            else:
+                return result
+
+    def report(self, scheme, status, **kwargs):
+        """Record the result of the test of `scheme` in the report"""
+        report.record(
+            self.test_type,
+            scheme,
+            self.opt_label,
+            self.compile_mode.lower(),
+            status,
+            **kwargs,
         )
 
-        result = None
-
-        if p.returncode != 0:
-            log.error(
-                f"Running '{cmd}' failed: {p.returncode} {p.stderr.decode()}",
+    def _run_hashed(self, cmd, tee_dir=None, output_sink=None):
+        """Run cmd, hashing its output incrementally so that memory use is
+        independent of the output size
+
+        Returns a CompletedProcess with the hex SHA-256 digest of the
+        output as stdout."""
+        tee = None
+        if tee_dir is not None:
+            os.makedirs(tee_dir, exist_ok=True)
+            tee = os.path.join(
+                tee_dir, f"{os.path.basename(cmd[-1])}.{self.opt_label}.txt"
             )
-        elif check_proc is not None:
-            result, err = check_proc(scheme, p.stdout)
-            if result:
-                log.error(f"{err}")
-            else:
-                log.info(f"passed")
-        else:
-            log.info(f"\n{p.stdout.decode()}")
-            result = p.stdout.decode()
 
-        if p.returncode != 0:
-            exit(p.returncode)
-        else:
-            return result
+        # stderr goes to a file, so the process can't block on a full pipe
+        # while we are reading stdout
+        with tempfile.TemporaryFile() as stderr, (
+            open(tee, "wb") if tee is not None else nullcontext()
+        ) as out:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr)
+            with proc.stdout:
+                digest = sha256stream(proc.stdout, out, output_sink)
+            proc.wait()
+            stderr.seek(0)
+            return subprocess.CompletedProcess(
+                cmd, proc.returncode, digest, stderr.read()
+            )
 
 
 class Test_Implementations:
-    def __init__(self, test_type: TEST_TYPES, copts: CompileOptions):
+    def __init__(self, test_type: TEST_TYPES, copts: CompileOptions, cache=None):
         self.test_type = test_type
         self.compile_mode = copts.compile_mode()
         self.ts = {}
-        self.ts["opt"] = Base(test_type, copts, True)
-        self.ts["no_opt"] = Base(test_type, copts, False)
-
-    def compile(
-        self,
-        opt,
-        extra_make_envs=None,
-        extra_make_args=None,
-    ):
-        self.ts["opt" if opt else "no_opt"].compile_schemes(
-            extra_make_envs,
-            extra_make_args,
-        )
+        self.ts["opt"] = Base(test_type, copts, True, cache)
+        self.ts["no_opt"] = Base(test_type, copts, False, cache)
 
     def run_scheme(
         self,
@@ -207,6 +377,10 @@ class Test_Implementations:
         check_proc=None,
         cmd_prefix=None,
         extra_args=None,
+        vectors=None,
+        hash_output=False,
+        tee_dir=None,
+        output_sink=None,
     ):
         """Arguments:
 
@@ -216,6 +390,13 @@ class Test_Implementations:
             raw byte-output of the test run with.
         - cmd_prefix: Command prefix; array of strings, or None
         - extra_args: Extra arguments; array of strings, or None
+        - vectors: Callable mapping the scheme to the digest of its
+            test vectors, or None
+        - hash_output: Pass the SHA-256 digest of the output to
+            check_proc instead of the output, see Base.run_scheme
+        - tee_dir: Directory to write a copy of the output to, or None
+        - output_sink: Callable mapping the scheme to an object with a
+            `write` method to pass the output to, or None
         """
         if cmd_prefix is None:
             cmd_prefix = []
@@ -228,12 +409,31 @@ class Test_Implementations:
         results = {}
         results[k] = {}
         results[k][scheme] = self.ts[k].run_scheme(
-            scheme, check_proc, cmd_prefix, extra_args
+            scheme,
+            check_proc,
+            cmd_prefix,
+            extra_args,
+            vectors(scheme) if vectors is not None else None,
+            hash_output,
+            tee_dir,
+            output_sink(scheme) if output_sink is not None else None,
         )
 
         return results
 
-    def run_schemes(self, opt, check_proc=None, cmd_prefix=None, extra_args=None):
+    def run_schemes(
+        self,
+        opt,
+        check_proc=None,
+        cmd_prefix=None,
+        extra_args=None,
+        vectors=None,
+        parallel=True,
+        hash_output=False,
+        tee_dir=None,
+        output_sink=None,
+        schemes=None,
+    ):
         """Arguments:
 
         - opt: Whether native backends should be enabled
@@ -241,11 +441,23 @@ class Test_Implementations:
                       of the test run with.
         - cmd_prefix: Command prefix; array of strings
         - extra_args: Extra arguments; array of strings
+        - vectors: Callable mapping the scheme to the digest of its
+                   test vectors, or None
+        - parallel: Whether to run the parameter sets concurrently
+        - hash_output: Pass the SHA-256 digest of the output to
+                       check_proc instead of the output
+        - tee_dir: Directory to write a copy of the output to, or None
+        - output_sink: Callable mapping the scheme to an object with a
+                       `write` method to pass the output to, or None
+        - schemes: Parameter sets to run, or None for all; the results
+                   of the others are None
         """
         if cmd_prefix is None:
             cmd_prefix = []
         if extra_args is None:
             extra_args = []
+        if schemes is None:
+            schemes = list(SCHEME)
 
         # Returns
         results = {}
@@ -255,16 +467,35 @@ class Test_Implementations:
         if gh_env is not None:
             print(f"::group::run {self.compile_mode} {k} {self.test_type.desc()}")
 
-        results[k] = {}
-        for scheme in SCHEME:
-            result = self.ts[k].run_scheme(
-                scheme,
-                check_proc,
-                cmd_prefix,
-                extra_args,
-            )
+        # The binaries of the parameter sets are independent, so run them
+        # concurrently, using up to --jobs threads
+        jobs = max(1, min(self.ts[k].jobs, len(SCHEME))) if parallel else 1
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {
+                scheme: executor.submit(
+                    self.ts[k].run_scheme,
+                    scheme,
+                    check_proc,
+                    cmd_prefix,
+                    extra_args,
+                    vectors(scheme) if vectors is not None else None,
+                    hash_output,
+                    tee_dir,
+                    output_sink(scheme) if output_sink is not None else None,
+                )
+                for scheme in schemes
+            }
+            results[k] = {
+                scheme: futures[scheme].result() if scheme in futures else None
+                for scheme in SCHEME
+            }
 
-            results[k][scheme] = result
+        for scheme in SCHEME:
+            if scheme not in futures:
+                logger(self.test_type, scheme, self.ts[k].cross_prefix, opt).info(
+                    "skipped (not selected)"
+                )
+                self.ts[k].report(scheme, "skipped", message="not selected")
 
         title = "## " + (self.compile_mode) + " " + (k.capitalize()) + " Tests"
         github_summary(title, self.test_type.desc(), results[k])
@@ -275,7 +506,7 @@ class Test_Implementations:
         ## TODO What is happening here?
         if check_proc is not None:
             return reduce(
-                lambda acc, c: acc or c,
+                lambda acc, c: acc or bool(c),
                 [r for rs in results.values() for r in rs.values()],
                 False,
             )
@@ -296,14 +527,39 @@ class Tests:
             opts.cflags,
             opts.auto,
             opts.verbose,
+            opts.jobs,
+            opts.compiler_cache,
+            opts.keep_going,
+            opts.build_dir,
         )
         self.opt = opts.opt
+        self.jobs = opts.jobs
+        self.keep_going = opts.keep_going
 
         self.verbose = opts.verbose
+        self.kat_output = opts.kat_output
+        self.changed_since = opts.changed_since
+        self._changed = None
+        self._dep_graphs = {}
+        self._selections = {}
+        self.shard = parse_shard(opts.shard) if opts.shard is not None else None
+        self.timings = opts.timings
+        self._units = None
+        # Test implementations run by the current command, see _shard_units
+        self._impls = []
+        if opts.trace is not None:
+            tracer.enable(opts.trace)
+        if opts.report is not None or opts.junit is not None:
+            report.enable(opts.report, opts.junit)
+        if self.keep_going:
+            # Failures are collected in the report, and listed at exit
+            report.enable()
+            atexit.register(self._log_failures)
+        self.cache = ResultCache(opts.cache_file) if opts.use_cache else None
         self._func = Test_Implementations(TEST_TYPES.MLKEM, copts)
-        self._nistkat = Test_Implementations(TEST_TYPES.NISTKAT, copts)
-        self._kat = Test_Implementations(TEST_TYPES.KAT, copts)
-        self._acvp = Test_Implementations(TEST_TYPES.ACVP, copts)
+        self._nistkat = Test_Implementations(TEST_TYPES.NISTKAT, copts, self.cache)
+        self._kat = Test_Implementations(TEST_TYPES.KAT, copts, self.cache)
+        self._acvp = Test_Implementations(TEST_TYPES.ACVP, copts, self.cache)
         self._bench = Test_Implementations(TEST_TYPES.BENCH, copts)
         self._bench_components = Test_Implementations(
             TEST_TYPES.BENCH_COMPONENTS, copts
@@ -325,6 +581,281 @@ class Tests:
                 logging.info(f"Running with customized wrapper {opts.exec_wrapper}")
                 self.cmd_prefix = self.cmd_prefix + opts.exec_wrapper.split(" ")
 
+    def _run_opts(self, f):
+        """Run f(opt) for the opt values selected via --opt, stopping at the
+        first failure unless --keep-going is given. Returns whether any of
+        the runs failed."""
+        fail = False
+        for opt in self._opts():
+            if fail and not self.keep_going:
+                break
+            fail = bool(f(opt)) or fail
+        return fail
+
+    def _log_failures(self):
+        """List all failed tests, see --keep-going"""
+        failures = [c for c in report.results() if c["status"] == "fail"]
+        log = logging.getLogger("Failures")
+        if len(failures) == 0:
+            return
+        log.error(f"{len(failures)} tests failed:")
+        for c in failures:
+            log.error(
+                f"{c['desc']} {c['scheme']} ({c['mode']}, {c['opt']}): {c['message']}"
+            )
+
+    def _opts(self):
+        """opt values selected via --opt, in the order they are run"""
+        return [
+            opt
+            for opt, label in [(False, "no_opt"), (True, "opt")]
+            if self.opt.lower() in ["all", label]
+        ]
+
+    def _changes(self):
+        """Files changed since --changed-since, or the last batch of
+        changes in watch mode; None if all binaries are to be tested"""
+        if self._changed is None and self.changed_since is not None:
+            self._changed = {
+                os.path.normpath(path(fn)) for fn in changed_files(self.changed_since)
+            }
+            logging.getLogger("Changed files").info(
+                f"{len(self._changed)} files changed since {self.changed_since}"
+            )
+        return self._changed
+
+    def _set_changes(self, changed):
+        """Select the binaries affected by `changed`, see watch()"""
+        self._changed = {os.path.normpath(fn) for fn in changed}
+        self._dep_graphs = {}
+        self._selections = {}
+
+    def _shard_units(self):
+        """Units of work of this shard, see --shard, or None"""
+        if self.shard is None:
+            return None
+        if self._units is not None:
+            return self._units
+
+        ranges = acvp_ranges(path("test/acvp_data"))
+        acvp_vectors = {}
+        for (param, _), rs in ranges.items():
+            acvp_vectors[param] = acvp_vectors.get(param, 0) + sum(r[2] for r in rs)
+
+        units = []
+        for opt in self._opts():
+            label = "opt" if opt else "no_opt"
+            for t in self._impls:
+                for s in SCHEME:
+                    if t.test_type != TEST_TYPES.ACVP:
+                        units.append(Unit(str(t.test_type), label, str(s)))
+                        continue
+                    for mode in ["keyGen", "encapDecap"]:
+                        for lo, hi, n in ranges.get((str(s), mode), []):
+                            units.append(
+                                Unit(str(t.test_type), label, str(s), mode, (lo, hi), n)
+                            )
+
+        timings = {}
+        if self.timings is not None and os.path.isfile(self.timings):
+            timings = load_timings(self.timings)
+        (i, n) = self.shard
+        keys = partition(units, n, timings, acvp_vectors)[i - 1]
+        self._units = [u for u in units if u.key() in keys]
+        logging.getLogger("Shard").info(
+            f"{i}/{n}: {len(self._units)} of {len(units)} units"
+            + (" (weighted by timings)" if timings else "")
+        )
+        return self._units
+
+    def _selected(self, impl, opt):
+        """Parameter sets to build and run the test implementation `impl`
+        for: those in this shard, see _shard_units(), which are affected by
+        the changes, see _changes()"""
+        schemes = self._affected(impl, opt)
+        units = self._shard_units()
+        if units is None or impl not in self._impls:
+            return schemes
+        label = "opt" if opt else "no_opt"
+        return [
+            s
+            for s in schemes
+            if any(
+                u.test == str(impl.test_type) and u.opt == label and u.scheme == str(s)
+                for u in units
+            )
+        ]
+
+    def _affected(self, impl, opt):
+        """Parameter sets whose binary of the test implementation `impl`
+        is affected by the changes, see _changes(), or all of them"""
+        changed = self._changes()
+        if changed is None or impl.test_type not in [
+            TEST_TYPES.MLKEM,
+            TEST_TYPES.NISTKAT,
+            TEST_TYPES.KAT,
+            TEST_TYPES.ACVP,
+        ]:
+            return list(SCHEME)
+
+        if (impl.test_type, opt) in self._selections:
+            return self._selections[(impl.test_type, opt)]
+
+        base = impl.ts["opt" if opt else "no_opt"]
+        if opt not in self._dep_graphs:
+            # A single graph for the binaries of all test types
+            bins = [
+                t.bin_path(s, base.build_dir)
+                for t in [
+                    TEST_TYPES.MLKEM,
+                    TEST_TYPES.NISTKAT,
+                    TEST_TYPES.KAT,
+                    TEST_TYPES.ACVP,
+                ]
+                for s in SCHEME
+            ]
+            self._dep_graphs[opt] = DepGraph(base.make_vars(), bins, base.cross_prefix)
+
+        graph = self._dep_graphs[opt]
+        rerun = any(matches(fn, TEST_INPUTS[str(impl.test_type)]) for fn in changed)
+        self._selections[(impl.test_type, opt)] = [
+            s
+            for s in SCHEME
+            if rerun
+            or graph.affected(impl.test_type.bin_path(s, base.build_dir), changed)
+        ]
+        return self._selections[(impl.test_type, opt)]
+
+    def _compile(self, impls, opts, extra_make_args=None):
+        """Compile the binaries of several test implementations, for opt
+        and/or no_opt, with a single make invocation
+
+        opt and no_opt builds live in separate build roots, see build_dir(),
+        so both are built by concurrent sub-makes sharing a single job pool.
+        """
+        if len(impls) == 0 or len(opts) == 0:
+            return
+
+        targets = list(dict.fromkeys(t.test_type.make_target() for t in impls))
+        bases = [impls[0].ts["opt" if opt else "no_opt"] for opt in opts]
+        root_targets = [targets] * len(bases)
+
+        if self._changes() is not None or self._shard_units() is not None:
+            # Build only the binaries affected by the changes, in this shard
+            root_targets = [
+                [
+                    t.test_type.bin_path(s, b.build_dir)
+                    for t in impls
+                    for s in self._selected(t, b.opt)
+                ]
+                for b in bases
+            ]
+            bases = [b for b, ts in zip(bases, root_targets) if ts]
+            root_targets = [ts for ts in root_targets if ts]
+            if len(bases) == 0:
+                logging.getLogger("Compile").info(
+                    "Nothing to compile, no binaries selected"
+                )
+                return
+
+        labels = [b.opt_label for b in bases]
+        for t in impls:
+            for b in bases:
+                t.ts[b.opt_label].stale.clear()
+
+        if gh_env is not None:
+            print(
+                f"::group::compile {self.compile_mode} {' '.join(labels)} "
+                + ", ".join(t.test_type.desc() for t in impls)
+            )
+
+        log = logging.getLogger(
+            "{:<18} {:<11} ({:<6}, {:>6})".format(
+                "Compile",
+                " ".join(targets),
+                "cross" if bases[0].cross_prefix else "native",
+                "+".join(labels),
+            )
+        )
+
+        env = os.environ.copy()
+        if bases[0].cflags is not None:
+            env["CFLAGS"] = bases[0].cflags
+
+        sub_makes = [
+            b.make_vars(extra_make_args) + ts for b, ts in zip(bases, root_targets)
+        ]
+        # With --keep-going, build as much as possible; -k is passed on to
+        # sub-makes via MAKEFLAGS
+        make = ["make", f"-j{self.jobs}"] + (["-k"] if self.keep_going else [])
+        if len(sub_makes) == 1:
+            args = make + sub_makes[0]
+            plan = None
+            log.info(" ".join(args))
+        else:
+            # Top-level makefile running one sub-make per build root, so
+            # that all of them share the job slots given by -j
+            args = make + ["-f", "-", "all"]
+            plan = f".PHONY: all {' '.join(labels)}\nall: {' '.join(labels)}\n"
+            for label, m in zip(labels, sub_makes):
+                plan += f"{label}:\n\t+$(MAKE) {' '.join(shlex.quote(a) for a in m)}\n"
+                log.info("make " + " ".join(m))
+
+        compiler_cache = bases[0].compiler_cache
+        stats = compiler_cache_stats(compiler_cache)
+        start = time.perf_counter()
+        with tracer.span(
+            "compile",
+            "make",
+            test=", ".join(t.test_type.desc() for t in impls),
+            opt="+".join(labels),
+        ):
+            p = subprocess.run(
+                args,
+                input=plan,
+                stdout=subprocess.DEVNULL if not self.verbose else None,
+                env=env,
+                universal_newlines=True,
+            )
+        report.compiled(
+            [t.test_type for t in impls],
+            labels,
+            self.compile_mode.lower(),
+            time.perf_counter() - start,
+            p.returncode == 0,
+        )
+        log_compiler_cache_stats(log, stats, compiler_cache_stats(compiler_cache))
+
+        if p.returncode != 0:
+            log.error(f"make failed: {p.returncode}")
+
+        if p.returncode != 0 and self.keep_going:
+            self._find_stale(impls, bases, log, extra_make_args)
+
+        if gh_env is not None:
+            print(f"::endgroup::")
+
+        if p.returncode != 0 and not self.keep_going:
+            sys.exit(1)
+
+    def _find_stale(self, impls, bases, log, extra_make_args=None):
+        """After a failed build with --keep-going, mark the binaries which
+        are not up to date, so that their tests fail instead of running
+        stale binaries"""
+        for b in bases:
+            for t in impls:
+                base = t.ts[b.opt_label]
+                for s in self._selected(t, b.opt):
+                    bin = t.test_type.bin_path(s, b.build_dir)
+                    p = subprocess.run(
+                        ["make", "-q"] + base.make_vars(extra_make_args) + [bin],
+                        stdout=subprocess.DEVNULL,
+                        stderr=subprocess.DEVNULL,
+                    )
+                    if p.returncode != 0:
+                        base.stale.add(bin)
+                        log.error(f"{bin} could not be rebuilt")
+
     def _run_func(self, opt):
         """Underlying function for functional test"""
 
@@ -352,166 +883,307 @@ class Tests:
             opt,
             check_proc=expect,
             cmd_prefix=self.cmd_prefix,
+            schemes=self._selected(self._func, opt),
         )
 
     def func(self):
         config_logger(self.verbose)
 
-        def _func(opt):
+        self._impls = [self._func]
+        if self.compile:
+            self._compile([self._func], self._opts())
 
-            if self.compile:
-                self._func.compile(opt)
+        def _func(opt):
             if self.run:
                 return self._run_func(opt)
 
-        fail = False
-        if self.opt.lower() == "all" or self.opt.lower() == "no_opt":
-            fail = fail or _func(False)
-        if self.opt.lower() == "all" or self.opt.lower() == "opt":
-            fail = fail or _func(True)
+        fail = self._run_opts(_func)
 
         if fail:
             exit(1)
 
-    def _run_nistkat(self, opt):
-        def check_proc(scheme, raw):
-            """Checks whether the hashed output of the scheme matches the META.yml"""
+    def _kat_check(self, field):
+        """Check of the hashed KAT output against `field` of META.json
 
-            actual = sha256sum(raw)
-            expect = parse_meta(scheme, "nistkat-sha256")
+        Returns (check_proc, output_sink) for run_schemes. If META.json
+        also has per-chunk digests `<field>-chunks`, a mismatch is narrowed
+        down to the first diverging test vectors and field."""
+        sinks = {}
+
+        def output_sink(scheme):
+            chunks = parse_meta(scheme, f"{field}-chunks", optional=True)
+            if chunks is None:
+                return None
+            sinks[scheme] = (KATDigests(chunks["vectors-per-chunk"]), chunks)
+            return sinks[scheme][0]
+
+        def check_proc(scheme, actual):
+            """Checks whether the hashed output of the scheme matches the META.yml"""
+            expect = parse_meta(scheme, field)
             fail = expect != actual
+            if not fail:
+                return (False, "")
+
+            err = f"Failed, expecting {expect}, but getting {actual}"
+            if scheme in sinks:
+                (digests, chunks) = sinks[scheme]
+                div = digests.first_divergence(chunks)
+                if div is None:
+                    err += "; all test vectors match, the difference is elsewhere"
+                else:
+                    (lo, hi, f) = div
+                    vectors = f"vector {lo}" if lo == hi else f"vectors {lo}-{hi}"
+                    if f is None:
+                        err += f"; first divergence: {vectors} missing or extra"
+                    else:
+                        err += f"; first divergence: {vectors}, field {f}"
+            else:
+                err += (
+                    f"; cannot locate the first divergence without {field}-chunks"
+                    " in META.json, see scripts/kat-digests"
+                )
+            return (True, err)
 
-            return (
-                fail,
-                f"Failed, expecting {expect}, but getting {actual}" if fail else "",
-            )
+        return (check_proc, output_sink)
+
+    def _run_nistkat(self, opt):
+        (check_proc, output_sink) = self._kat_check("nistkat-sha256")
 
         return self._nistkat.run_schemes(
             opt,
             check_proc=check_proc,
             cmd_prefix=self.cmd_prefix,
+            vectors=lambda scheme: parse_meta(scheme, "nistkat-sha256"),
+            hash_output=True,
+            tee_dir=self.kat_output,
+            output_sink=output_sink,
+            schemes=self._selected(self._nistkat, opt),
         )
 
     def nistkat(self):
         config_logger(self.verbose)
 
+        self._impls = [self._nistkat]
+        if self.compile:
+            self._compile([self._nistkat], self._opts())
+
         def _nistkat(opt):
-            if self.compile:
-                self._nistkat.compile(opt)
             if self.run:
                 return self._run_nistkat(opt)
 
-        fail = False
-        if self.opt.lower() == "all" or self.opt.lower() == "no_opt":
-            fail = fail or _nistkat(False)
-        if self.opt.lower() == "all" or self.opt.lower() == "opt":
-            fail = fail or _nistkat(True)
+        fail = self._run_opts(_nistkat)
 
         if fail:
             exit(1)
 
     def _run_kat(self, opt):
-        def check_proc(scheme, raw):
-            """Checks whether the hashed output of the scheme matches the META.yml"""
-            actual = sha256sum(raw)
-            expect = parse_meta(scheme, "kat-sha256")
-            fail = expect != actual
-
-            return (
-                fail,
-                f"Failed, expecting {expect}, but getting {actual}" if fail else "",
-            )
+        (check_proc, output_sink) = self._kat_check("kat-sha256")
 
         return self._kat.run_schemes(
             opt,
             check_proc=check_proc,
             cmd_prefix=self.cmd_prefix,
+            vectors=lambda scheme: parse_meta(scheme, "kat-sha256"),
+            hash_output=True,
+            tee_dir=self.kat_output,
+            output_sink=output_sink,
+            schemes=self._selected(self._kat, opt),
         )
 
     def kat(self):
         config_logger(self.verbose)
 
+        self._impls = [self._kat]
+        if self.compile:
+            self._compile([self._kat], self._opts())
+
         def _kat(opt):
-            if self.compile:
-                self._kat.compile(opt)
             if self.run:
                 return self._run_kat(opt)
 
-        fail = False
-
-        if self.opt.lower() == "all" or self.opt.lower() == "no_opt":
-            fail = fail or _kat(False)
-        if self.opt.lower() == "all" or self.opt.lower() == "opt":
-            fail = fail or _kat(True)
+        fail = self._run_opts(_kat)
 
         if fail:
             exit(1)
 
     def _run_acvp(self, opt):
-
         opt_label = "opt" if opt else "no_opt"
-        log = logger(TEST_TYPES.ACVP, "Run", self._acvp.ts[opt_label].cross_prefix, opt)
 
-        if gh_env is not None:
-            print(
-                f"::group::run {self.compile_mode} {opt_label} {TEST_TYPES.ACVP.desc()}"
+        with tracer.span("run_acvp", "run", test=TEST_TYPES.ACVP.desc(), opt=opt_label):
+            log = logger(
+                TEST_TYPES.ACVP, "Run", self._acvp.ts[opt_label].cross_prefix, opt
             )
 
-        env_update = {"EXEC_WRAPPER": " ".join(self.cmd_prefix)}
-        env = os.environ.copy()
-        env.update(env_update)
-
-        def dict2str(dict):
-            s = ""
-            for k, v in dict.items():
-                s += f"{k}={v} "
-            return s
-
-        args = ["make", "check_acvp"]
-        log.info(dict2str(env_update) + " ".join(args))
-
-        p = subprocess.run(
-            args,
-            capture_output=True,
-            universal_newlines=False,
-            env=env,
-        )
-        fail = p.returncode != 0
-        if fail is True:
-            log.error(p.stderr.decode())
-            log.error(f"ACVP test failed: {p.returncode}")
-
-        results = {}
-        results[opt_label] = {}
-        for s in SCHEME:
-            results[opt_label][s] = fail
-
-        if gh_env is not None:
-            print(f"::endgroup::")
+            if gh_env is not None:
+                print(
+                    f"::group::run {self.compile_mode} {opt_label} {TEST_TYPES.ACVP.desc()}"
+                )
 
-        for k, result in results.items():
-            title = (
-                "## " + (self._acvp.compile_mode) + " " + (k.capitalize()) + " Tests"
-            )
-            github_summary(title, f"{TEST_TYPES.ACVP.desc()}", result)
+            env_update = {"EXEC_WRAPPER": " ".join(self.cmd_prefix)}
+            env = os.environ.copy()
+            env.update(env_update)
+
+            schemes = self._selected(self._acvp, opt)
+
+            # Binaries which could not be rebuilt, see --keep-going
+            base = self._acvp.ts[opt_label]
+            stale = [
+                s
+                for s in schemes
+                if TEST_TYPES.ACVP.bin_path(s, base.build_dir) in base.stale
+            ]
+            for s in stale:
+                msg = f"{TEST_TYPES.ACVP.bin_path(s, base.build_dir)} could not be rebuilt"
+                log.error(msg)
+                base.report(s, "fail", message=msg)
+            schemes = [s for s in schemes if s not in stale]
+
+            cache_keys = {}
+            # A shard only runs some of the test vectors, so its results
+            # must not be cached
+            if self.cache is not None and self.shard is None:
+                acvp_data = path("test/acvp_data")
+                vectors = sha256sum(
+                    "".join(
+                        sha256file(os.path.join(acvp_data, fn))
+                        for fn in sorted(os.listdir(acvp_data))
+                        if fn.endswith(".json")
+                    ).encode()
+                )
+                for s in schemes:
+                    cache_keys[s] = self.cache.key(
+                        TEST_TYPES.ACVP.bin_path(s, base.build_dir),
+                        TEST_TYPES.ACVP,
+                        vectors,
+                    )
+
+            # The binaries were built by _compile, so bypass make check_acvp,
+            # which would build all of them
+            args = [
+                "python3",
+                path("test/acvp_client.py"),
+                "--build-dir",
+                base.build_dir,
+            ]
+            if self.keep_going:
+                args.append("--keep-going")
+
+            # Runs of the ACVP client, as (parameter sets, extra arguments)
+            units = self._shard_units()
+            if units is not None:
+                runs = [
+                    (
+                        [s],
+                        [
+                            f"--param={s}",
+                            f"--mode={u.mode}",
+                            f"--tc={u.tc_range[0]}-{u.tc_range[1]}",
+                        ],
+                    )
+                    for s in schemes
+                    for u in units
+                    if u.test == str(TEST_TYPES.ACVP)
+                    and u.opt == opt_label
+                    and u.scheme == str(s)
+                ]
+            elif self._changes() is not None or stale:
+                runs = [(schemes, [f"--param={s}" for s in schemes])]
+            else:
+                runs = [(schemes, [])]
+
+            fails = {s: False for s in schemes}
+            if len(schemes) == 0:
+                if not stale:
+                    log.info("skipped (not selected)")
+            elif cache_keys and all(self.cache.passed(k) for k in cache_keys.values()):
+                log.info(f"passed (cached)")
+                for s in schemes:
+                    base.report(
+                        s,
+                        "pass",
+                        bin=TEST_TYPES.ACVP.bin_path(s, base.build_dir),
+                        cached=True,
+                    )
+            else:
+                durations = {s: 0.0 for s in schemes}
+                stderrs = {s: b"" for s in schemes}
+                codes = {s: 0 for s in schemes}
+                for run_schemes, extra_args in runs:
+                    if any(fails.values()) and not self.keep_going:
+                        break
+                    log.info(dict2str(env_update) + " ".join(args + extra_args))
+
+                    start = time.perf_counter()
+                    p = subprocess.run(
+                        args + extra_args,
+                        capture_output=True,
+                        universal_newlines=False,
+                        env=env,
+                    )
+                    duration = time.perf_counter() - start
+                    if p.returncode != 0:
+                        log.error(p.stderr.decode())
+                        log.error(f"ACVP test failed: {p.returncode}")
+
+                    # A single run may test several parameter sets
+                    for s in run_schemes:
+                        fails[s] = fails[s] or p.returncode != 0
+                        durations[s] += duration
+                        stderrs[s] += p.stderr
+                        codes[s] = codes[s] or p.returncode
+
+                for s in schemes:
+                    if s in cache_keys:
+                        self.cache.record(cache_keys[s], not fails[s])
+                    base.report(
+                        s,
+                        "fail" if fails[s] else "pass",
+                        duration=durations[s],
+                        bin=TEST_TYPES.ACVP.bin_path(s, base.build_dir),
+                        stderr=stderrs[s],
+                        message=f"exit code {codes[s]}" if fails[s] else None,
+                    )
+            fail = any(fails.values())
+
+            for s in SCHEME:
+                if s not in schemes and s not in stale:
+                    base.report(s, "skipped", message="not selected")
+
+            results = {}
+            results[opt_label] = {}
+            for s in SCHEME:
+                results[opt_label][s] = (
+                    fails[s] if s in schemes else True if s in stale else None
+                )
+            fail = fail or len(stale) > 0
+
+            if gh_env is not None:
+                print(f"::endgroup::")
+
+            for k, result in results.items():
+                title = (
+                    "## "
+                    + (self._acvp.compile_mode)
+                    + " "
+                    + (k.capitalize())
+                    + " Tests"
+                )
+                github_summary(title, f"{TEST_TYPES.ACVP.desc()}", result)
 
-        return fail
+            return fail
 
     def acvp(self, acvp_dir):
         config_logger(self.verbose)
 
+        self._impls = [self._acvp]
+        if self.compile:
+            self._compile([self._acvp], self._opts())
+
         def _acvp(opt):
-            if self.compile:
-                self._acvp.compile(opt)
             if self.run:
                 return self._run_acvp(opt)
 
-        fail = False
-
-        if self.opt.lower() == "all" or self.opt.lower() == "no_opt":
-            fail = fail or _acvp(False)
-        if self.opt.lower() == "all" or self.opt.lower() == "opt":
-            fail = fail or _acvp(True)
+        fail = self._run_opts(_acvp)
 
         if fail:
             exit(1)
@@ -520,8 +1192,12 @@ class Tests:
         self,
         t,  # Testmplementations
         opt,
+        extra_args=None,
     ):
-        return t.run_schemes(opt, cmd_prefix=self.cmd_prefix)
+        # Benchmarks must not compete for the CPU, so run them one by one
+        return t.run_schemes(
+            opt, cmd_prefix=self.cmd_prefix, extra_args=extra_args, parallel=False
+        )
 
     def bench(
         self,
@@ -529,95 +1205,155 @@ class Tests:
         output,
         mac_taskpolicy,
         components,
+        warmup=None,
+        iterations=None,
+        samples=None,
+        json_output=None,
+        dump_samples=False,
+        threads=None,
+        affinity=False,
+        calibrate=False,
     ):
         config_logger(self.verbose)
 
+        # Options of bench_mlkem, see USAGE in test/bench_mlkem.c
+        extra_args = []
+        for flag, value in [("-w", warmup), ("-i", iterations), ("-n", samples)]:
+            if value is not None:
+                extra_args += [flag, str(value)]
+        if dump_samples:
+            extra_args.append("-r")
+        if calibrate:
+            extra_args.append("-c")
+        if threads is not None:
+            extra_args += ["-t", str(threads)] + (["-a"] if affinity else [])
+        elif affinity:
+            logging.error("--affinity requires --threads")
+            exit(1)
+        if components and extra_args:
+            logging.error(
+                "--warmup, --iterations, --samples, --dump-samples, --calibrate and --threads are not supported with --components"
+            )
+            exit(1)
+        if threads is not None and output is not None:
+            logging.error("--output is not supported with --threads, use --json")
+            exit(1)
+        if threads is not None and (samples is not None or dump_samples or calibrate):
+            logging.error(
+                "--samples, --dump-samples and --calibrate are not supported with --threads"
+            )
+            exit(1)
+
         if components is False:
             t = self._bench
         else:
             t = self._bench_components
-            output = False
 
         if mac_taskpolicy:
             self.cmd_prefix.extend(["taskpolicy", "-c", f"{mac_taskpolicy}"])
 
-        # NOTE: We haven't yet decided how to output both opt/no-opt benchmark results
-        if self.opt.lower() == "all":
-            if self.compile:
-                t.compile(False, extra_make_args=[f"CYCLES={cycles}"])
-            if self.run:
-                self._run_bench(t, False)
-            if self.compile:
-                t.compile(True, extra_make_args=[f"CYCLES={cycles}"])
-            if self.run:
-                resultss = self._run_bench(t, True)
-        else:
-            if self.compile:
-                t.compile(
-                    True if self.opt.lower() == "opt" else False,
-                    extra_make_args=[f"CYCLES={cycles}"],
-                )
-            if self.run:
-                resultss = self._run_bench(
-                    t,
-                    True if self.opt.lower() == "opt" else False,
-                )
+        extra_make_args = [f"CYCLES={cycles}"]
+        if self.compile:
+            self._compile([t], self._opts(), extra_make_args=extra_make_args)
+
+        resultss = {}
+        if self.run:
+            for opt in self._opts():
+                resultss.update(self._run_bench(t, opt, extra_args))
 
-        if resultss is None:
+        if len(resultss) == 0:
             exit(0)
 
-        # NOTE: There will only be one items in resultss, as we haven't yet decided how to write both opt/no-opt benchmark results
-        for k, results in resultss.items():
-            if results is not None and output is not None and components is False:
+        if json_output is not None:
+            self._write_bench_json(
+                json_output, t, cycles, resultss, extra_make_args, threads is not None
+            )
+
+        # --output is in the format of github-action-benchmark, which cannot
+        # tell opt and no_opt apart, so only the last of them is written
+        for k, results in list(resultss.items())[-1:]:
+            if output is not None and components is False:
                 import json
 
                 with open(output, "w") as f:
                     v = []
                     for scheme in results:
-                        schemeStr = str(scheme)
-                        r = results[scheme]
-
-                        # The first 3 lines of the output are expected to be
-                        # keypair cycles=X
-                        # encaps cycles=X
-                        # decaps cycles=X
-
-                        lines = [line for line in r.splitlines() if "=" in line]
-
-                        d = {
-                            k.strip(): int(v) for k, v in (l.split("=") for l in lines)
-                        }
+                        d = dict(bench.parse_kem(results[scheme]))
                         for primitive in ["keypair", "encaps", "decaps"]:
                             v.append(
                                 {
-                                    "name": f"{schemeStr} {primitive}",
-                                    "unit": "cycles",
-                                    "value": d[f"{primitive} cycles"],
+                                    "name": f"{scheme} {primitive}",
+                                    "unit": d[primitive]["unit"],
+                                    "value": d[primitive]["median"],
                                 }
                             )
                     f.write(json.dumps(v))
 
+    def _write_bench_json(
+        self, fn, t, cycles, resultss, extra_make_args, throughput=False
+    ):
+        """Write all results of a benchmark to `fn`, see bench.py"""
+        components = t.test_type == TEST_TYPES.BENCH_COMPONENTS
+        if components:
+            (benchmark, parse) = ("components", bench.parse_components)
+        elif throughput:
+            (benchmark, parse) = ("throughput", bench.parse_throughput)
+        else:
+            (benchmark, parse) = ("kem", bench.parse_kem)
+        tags = {
+            "compiler": None,
+            "cflags": {},
+            "cpu": bench.cpu_model(),
+            "machine": platform.machine(),
+            "cycles": cycles,
+        }
+        records = []
+        for k, results in resultss.items():
+            base = t.ts[k]
+            (cc, cflags) = base.make_variables(["CC", "CFLAGS"], extra_make_args)
+            tags["compiler"] = bench.compiler_version(cc)
+            tags["cflags"][k] = cflags
+            for scheme, r in results.items():
+                if r is None:
+                    continue
+                backend = bench.backends(
+                    t.test_type.bin_path(scheme, base.build_dir), base.cross_prefix
+                )
+                for name, result in parse(r):
+                    records.append(
+                        {
+                            "benchmark": benchmark,
+                            "scheme": str(scheme),
+                            "opt": k,
+                            "name": name,
+                            "backend": backend,
+                            "unit": "ops/s" if throughput else "cycles",
+                            **result,
+                        }
+                    )
+        bench.write(fn, tags, records)
+
     def all(self, func, kat, nistkat, acvp):
         config_logger(self.verbose)
 
-        def all(opt):
-            code = 0
-            if self.compile:
-                compiles = [
-                    *([self._func.compile] if func else []),
-                    *([self._nistkat.compile] if nistkat else []),
-                    *([self._kat.compile] if kat else []),
-                    *([self._acvp.compile] if acvp else []),
-                ]
+        self._impls = [
+            *([self._func] if func else []),
+            *([self._nistkat] if nistkat else []),
+            *([self._kat] if kat else []),
+            *([self._acvp] if acvp else []),
+        ]
 
-                for f in compiles:
-                    try:
-                        f(opt)
-                    except SystemExit as e:
-                        code = code or e
+        compile_code = 0
+        if self.compile:
+            try:
+                self._compile(self._impls, self._opts())
+            except SystemExit as e:
+                compile_code = e
 
-                    sys.stdout.flush()
+            sys.stdout.flush()
 
+        def all(opt):
+            code = compile_code
             if self.run:
                 runs = [
                     *([self._run_func] if func else []),
@@ -627,8 +1363,11 @@ class Tests:
                 ]
 
                 for f in runs:
+                    if code and not self.keep_going:
+                        break
                     try:
-                        code = code or int(f(opt))
+                        r = int(f(opt))
+                        code = code or r
                     except SystemExit as e:
                         code = code or e
 
@@ -637,13 +1376,76 @@ class Tests:
 
         exit_code = 0
 
-        if self.opt.lower() == "all" or self.opt.lower() == "no_opt":
-            exit_code = exit_code or all(False)
-        if self.opt.lower() == "all" or self.opt.lower() == "opt":
-            exit_code = exit_code or all(True)
+        for opt in self._opts():
+            if exit_code and not self.keep_going:
+                break
+            r = all(opt)
+            exit_code = exit_code or r
 
         exit(exit_code)
 
+    def watch(self, func, kat, nistkat, acvp):
+        """Rebuild and rerun the tests affected by every change to mlkem/,
+        test/ and mk/, printing a single line per batch of changes"""
+        config_logger(self.verbose)
+        if not self.verbose:
+            # Only failures are logged in detail
+            logging.getLogger().setLevel(logging.WARNING)
+
+        tests = [
+            *([(self._func, self._run_func)] if func else []),
+            *([(self._nistkat, self._run_nistkat)] if nistkat else []),
+            *([(self._kat, self._run_kat)] if kat else []),
+            *([(self._acvp, self._run_acvp)] if acvp else []),
+        ]
+        self._impls = [t for t, _ in tests]
+        w = watcher(
+            [path("mlkem"), path("test"), path("mk")], exclude=[path("test/build")]
+        )
+        print(
+            f"Watching mlkem/, test/ and mk/ ({type(w).__name__}), press Ctrl-C to stop",
+            flush=True,
+        )
+
+        try:
+            while True:
+                changed = w.wait()
+                start = time.monotonic()
+                self._set_changes(changed)
+
+                cells = []
+                fail = False
+                try:
+                    if self.compile:
+                        self._compile([t for t, _ in tests], self._opts())
+                    for opt in self._opts():
+                        for t, run in tests:
+                            schemes = self._selected(t, opt)
+                            if len(schemes) == 0 or not self.run:
+                                continue
+                            f = bool(run(opt))
+                            fail = fail or f
+                            cells.append(
+                                f"{t.test_type}/{'opt' if opt else 'no_opt'}/"
+                                + ",".join(s.suffix() for s in schemes)
+                                + (" FAIL" if f else " ok")
+                            )
+                except SystemExit:
+                    fail = True
+                    cells.append("compile FAIL")
+
+                files = sorted(changed)
+                files = files[0] + (f" +{len(files) - 1}" if len(files) > 1 else "")
+                status = "FAIL" if fail else "PASS" if cells else "----"
+                print(
+                    f"[{time.strftime('%H:%M:%S')}] {status} {files}: "
+                    + (", ".join(cells) if cells else "no tests affected")
+                    + f" ({time.monotonic() - start:.2f}s)",
+                    flush=True,
+                )
+        except KeyboardInterrupt:
+            pass
+
     def cbmc(self, k):
         config_logger(self.verbose)
 
@@ -670,3 +1472,77 @@ class Tests:
             run_cbmc("4")
         else:
             run_cbmc(k)
+
+
+def merge_reports(fns, json_fn=None, junit_fn=None):
+    """Combine the reports of several runs, e.g. the shards of a test run
+    given --shard, into a single report and summary. Returns whether any
+    test failed."""
+    if json_fn is not None or junit_fn is not None:
+        report.enable(json_fn, junit_fn)
+    report.merge(fns)
+
+    schemes = {str(s): s for s in SCHEME}
+    tables = {}
+    for c in report.results():
+        title = f"## {c['mode'].capitalize()} {c['opt'].capitalize()} Tests"
+        results = tables.setdefault(title, {}).setdefault(
+            (TEST_TYPES[c["test"].upper()], c["desc"]), {s: None for s in SCHEME}
+        )
+        if c["status"] != "skipped":
+            results[schemes[c["scheme"]]] = c["status"] == "fail"
+    for title, rows in tables.items():
+        for (_, desc), results in sorted(rows.items()):
+            github_summary(title, desc, results)
+
+    print("\n".join(summary.render([])))
+    return any(c["status"] == "fail" for c in report.results())
+
+
+def bench_compare(baseline, current, threshold, alpha):
+    """Compare two files written by `bench --json`, printing a line per
+    result present in both. Returns whether there were regressions."""
+    try:
+        (b, c) = (bench.load(baseline), bench.load(current))
+    except ValueError as e:
+        logging.error(e)
+        return True
+    rows = bench.compare(b, c, threshold, alpha)
+    if len(rows) == 0:
+        logging.error(f"No latency results in common between {baseline} and {current}")
+        return True
+
+    print(
+        "{:<10} {:<11} {:<6} {:<24} {:>10} {:>10} {:>8} {:>8}  {}".format(
+            "benchmark",
+            "scheme",
+            "opt",
+            "name",
+            "baseline",
+            "current",
+            "change",
+            "p",
+            "verdict",
+        )
+    )
+    for (benchmark, scheme, opt, name), b, c, change, p, verdict in rows:
+        print(
+            "{:<10} {:<11} {:<6} {:<24} {:>10} {:>10} {:>+7.2f}% {:>8}  {}".format(
+                benchmark,
+                scheme,
+                opt,
+                name,
+                b,
+                c,
+                change * 100,
+                "-" if p is None else f"{p:.2g}",
+                verdict,
+            )
+        )
+
+    regressions = [r for r in rows if r[5] == "regression"]
+    if regressions:
+        logging.error(
+            f"{len(regressions)} of {len(rows)} results regressed by more than {threshold:.0%}"
+        )
+    return len(regressions) > 0
@@ -0,0 +1,103 @@
+# Copyright (c) 2024 The mlkem-native project authors
+# SPDX-License-Identifier: Apache-2.0
+
+# Partitioning of tests across CI nodes, see `scripts/tests --shard`
+#
+# The work is split into units: one per test type, opt value and
+# parameter set, with ACVP tests further split by mode and ranges of test
+# case IDs. Units are assigned to shards greedily, heaviest first, to the
+# least loaded shard. Weights are the durations recorded in a previous
+# --report if available, and estimates otherwise. The assignment only
+# depends on the units and weights, so all nodes agree on it as long as
+# they are given the same options and timing file.
+
+import json
+
+from acvp_vectors import tc_ids
+
+# Number of ACVP test cases per unit
+ACVP_VECTORS_PER_UNIT = 25
+
+# Estimated durations in seconds, if there are no timings
+DEFAULT_WEIGHT = 1.0
+DEFAULT_ACVP_VECTOR_WEIGHT = 0.01
+
+
+def parse_shard(s):
+    """Parse a shard specification i/n, with 1 <= i <= n"""
+    (i, _, n) = s.partition("/")
+    if not (i.isdigit() and n.isdigit() and 1 <= int(i) <= int(n)):
+        raise ValueError(f"Invalid shard {s}, expecting i/n with 1 <= i <= n")
+    return (int(i), int(n))
+
+
+class Unit:
+    """A unit of work: a test of a single parameter set, or a range of
+    ACVP test cases of a single parameter set and mode"""
+
+    def __init__(self, test, opt, scheme, mode=None, tc_range=None, vectors=None):
+        self.test = test
+        self.opt = opt
+        self.scheme = scheme
+        self.mode = mode
+        self.tc_range = tc_range
+        self.vectors = vectors
+
+    def key(self):
+        k = f"{self.test}/{self.opt}/{self.scheme}"
+        if self.mode is not None:
+            k += f"/{self.mode}/{self.tc_range[0]}-{self.tc_range[1]}"
+        return k
+
+    def weight(self, timings, acvp_vectors):
+        """Expected duration, based on the durations of whole cells in
+        `timings`; ACVP cells are split by number of test cases"""
+        t = timings.get((self.test, self.opt, self.scheme))
+        if self.mode is None:
+            return t if t is not None else DEFAULT_WEIGHT
+        if t is None:
+            return self.vectors * DEFAULT_ACVP_VECTOR_WEIGHT
+        return t * self.vectors / acvp_vectors[self.scheme]
+
+
+def acvp_ranges(acvp_dir):
+    """Return {(parameter set, mode): [(lo, hi, #vectors)]}, splitting the
+    test cases of the internalProjection files into ranges of tcIds"""
+    return {
+        (param, mode): [
+            (
+                ids[i],
+                ids[min(i + ACVP_VECTORS_PER_UNIT, len(ids)) - 1],
+                min(ACVP_VECTORS_PER_UNIT, len(ids) - i),
+            )
+            for i in range(0, len(ids), ACVP_VECTORS_PER_UNIT)
+        ]
+        for (param, mode), ids in tc_ids(acvp_dir).items()
+    }
+
+
+def load_timings(fn):
+    """Run durations of the cells of a report written by --report, keyed
+    by (test, opt, scheme)"""
+    with open(fn, "r") as f:
+        results = json.load(f)["results"]
+    return {
+        (c["test"], c["opt"], c["scheme"]): c["run_duration"]
+        for c in results
+        if c["run_duration"] is not None and not c["cached"]
+    }
+
+
+def partition(units, n, timings, acvp_vectors):
+    """Assign units to n shards, returning a list of sets of unit keys"""
+    weighted = sorted(
+        ((u.weight(timings, acvp_vectors), u.key()) for u in units),
+        key=lambda x: (-x[0], x[1]),
+    )
+    shards = [set() for _ in range(n)]
+    loads = [0.0] * n
+    for w, key in weighted:
+        i = min(range(n), key=lambda i: (loads[i], i))
+        shards[i].add(key)
+        loads[i] += w
+    return shards
@@ -5,6 +5,11 @@ import os
 import sys
 import hashlib
 import logging
+import threading
+import time
+import atexit
+import xml.etree.ElementTree as ET
+from contextlib import contextmanager
 from enum import IntEnum
 from functools import reduce
 import json
@@ -17,12 +22,120 @@ def path(p):
     return os.path.relpath(os.path.join(ROOT, p), CWD)
 
 
+def build_dir(opt):
+    """Build root of the opt or no_opt build, as used by scripts/tests"""
+    return path(f"test/build/{'opt' if opt else 'no_opt'}")
+
+
 def sha256sum(result):
     m = hashlib.sha256()
     m.update(result)
     return m.hexdigest()
 
 
+def sha256file(fn):
+    m = hashlib.sha256()
+    with open(fn, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            m.update(chunk)
+    return m.hexdigest()
+
+
+def sha256stream(f, *sinks):
+    """Hash a binary stream incrementally until EOF, copying it to each of
+    `sinks` (objects with a `write` method; None entries are skipped)"""
+    sinks = [x for x in sinks if x is not None]
+    m = hashlib.sha256()
+    for chunk in iter(lambda: f.read(1 << 16), b""):
+        m.update(chunk)
+        for x in sinks:
+            x.write(chunk)
+    return m.hexdigest()
+
+
+class KATDigests:
+    """Per-chunk, per-field digests of KAT output
+
+    The output is split into test vectors, each starting with a line
+    `<first field> = ...`, where the first field is the one on the first
+    such line (pk for KAT, count for NISTKAT). For every chunk of
+    `vectors_per_chunk` consecutive test vectors, the lines of each field
+    are hashed separately. Other lines, e.g. comments, are ignored.
+
+    This allows pinpointing the first diverging test vector and field of
+    a KAT mismatch, in the same pass as the overall hash. META.json can
+    record the digests as `<kat>-sha256-chunks`, see scripts/kat-digests.
+    """
+
+    def __init__(self, vectors_per_chunk):
+        self.vectors_per_chunk = vectors_per_chunk
+        self.chunks = []
+        self.fields = []
+        self.vectors = 0
+        self.partial = b""
+
+    def write(self, data):
+        lines = (self.partial + data).split(b"\n")
+        self.partial = lines.pop()
+        for line in lines:
+            self._line(line + b"\n")
+
+    def _line(self, line):
+        (field, sep, _) = line.partition(b" = ")
+        if sep == b"":
+            return
+        field = field.decode()
+        if not self.fields:
+            self.fields.append(field)
+        if field == self.fields[0]:
+            if self.vectors % self.vectors_per_chunk == 0:
+                self.chunks.append({})
+            self.vectors += 1
+        elif field not in self.fields:
+            self.fields.append(field)
+        if not self.chunks:
+            return
+        chunk = self.chunks[-1]
+        if field not in chunk:
+            chunk[field] = hashlib.sha256()
+        chunk[field].update(line)
+
+    def digests(self):
+        """Digests in the format of `<kat>-sha256-chunks` in META.json"""
+        if self.partial != b"":
+            self._line(self.partial)
+            self.partial = b""
+        return {
+            "vectors-per-chunk": self.vectors_per_chunk,
+            "fields": self.fields,
+            "sha256": [
+                [c[f].hexdigest() if f in c else "" for f in self.fields]
+                for c in self.chunks
+            ],
+        }
+
+    def first_divergence(self, expect):
+        """Compare against digests in the format of `digests()`
+
+        Returns (first vector, last vector, field) of the first mismatching
+        chunk and field, or None if all chunks match. The field is None if
+        the chunk is missing from either side."""
+        actual = self.digests()
+        n = expect["vectors-per-chunk"]
+        fields = expect["fields"]
+        if n != actual["vectors-per-chunk"]:
+            raise ValueError("Inconsistent vectors-per-chunk")
+        for i in range(max(len(expect["sha256"]), len(actual["sha256"]))):
+            if i >= len(expect["sha256"]) or i >= len(actual["sha256"]):
+                return (i * n, (i + 1) * n - 1, None)
+            (e, a) = (expect["sha256"][i], actual["sha256"][i])
+            for f, ef in zip(fields, e):
+                af = a[actual["fields"].index(f)] if f in actual["fields"] else ""
+                if ef != af:
+                    return (i * n, (i + 1) * n - 1, f)
+        return None
+
+
 class SCHEME(IntEnum):
     MLKEM512 = 1
     MLKEM768 = 2
@@ -114,89 +227,388 @@ class TEST_TYPES(IntEnum):
         if self == TEST_TYPES.ACVP:
             return "acvp"
 
-    def bin_path(self, scheme):
-        return path(
-            f"test/build/{scheme.name.lower()}/bin/{self.bin()}{scheme.suffix()}"
+    def bin_path(self, scheme, root):
+        """Path of the binary for `scheme` in the build root `root`"""
+        return os.path.join(
+            root, scheme.name.lower(), "bin", f"{self.bin()}{scheme.suffix()}"
         )
 
 
-def parse_meta(scheme, field):
+class Tracer:
+    """Spans of the test driver, in Chrome trace-event format
+
+    Disabled by default; see `scripts/tests --trace`. The resulting file
+    can be loaded into chrome://tracing or https://ui.perfetto.dev."""
+
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self.lock = threading.Lock()
+        self.tids = {}
+        self.t0 = time.perf_counter()
+
+    def enable(self, fn):
+        """Start recording, and write the trace to fn at exit"""
+        self.enabled = True
+        atexit.register(self.write, fn)
+
+    def _tid(self):
+        # Small, stable thread IDs make for a more readable trace
+        return self.tids.setdefault(threading.get_ident(), len(self.tids))
+
+    @contextmanager
+    def span(self, name, cat, **args):
+        """Record the enclosed code as a span, with args as annotations"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self.lock:
+                self.events.append(
+                    {
+                        "name": name,
+                        "cat": cat,
+                        "ph": "X",
+                        "ts": (start - self.t0) * 1e6,
+                        "dur": (end - start) * 1e6,
+                        "pid": os.getpid(),
+                        "tid": self._tid(),
+                        "args": {k: str(v) for k, v in args.items()},
+                    }
+                )
+
+    def write(self, fn):
+        with self.lock:
+            events = list(self.events)
+        with open(fn, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+tracer = Tracer()
+
+
+class Report:
+    """Machine-readable report of all tests, see `scripts/tests --report`
+
+    Every test is recorded as a cell, identified by test type, parameter
+    set, opt label and compile mode, with its status ("pass", "fail" or
+    "skipped"), run time, the SHA-256 of its binary and an excerpt of its
+    stderr. Cells also carry the duration of the make invocation which
+    built their binary. Disabled by default; the report is written at
+    exit as JSON and/or JUnit XML."""
+
+    # Maximum number of characters of stderr kept per cell
+    EXCERPT = 4096
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.cells = {}
+        self.compile_times = {}
+
+    def enable(self, json_fn=None, junit_fn=None):
+        """Start recording, and write the report to the given files at exit"""
+        self.enabled = True
+        if json_fn is not None:
+            atexit.register(self.write_json, json_fn)
+        if junit_fn is not None:
+            atexit.register(self.write_junit, junit_fn)
+
+    def compiled(self, test_types, opt_labels, mode, duration, success):
+        """Record a make invocation building the binaries of `test_types`
+        for each of `opt_labels`"""
+        if not self.enabled:
+            return
+        with self.lock:
+            for t in test_types:
+                for opt_label in opt_labels:
+                    self.compile_times[(str(t), opt_label, mode)] = (
+                        duration,
+                        success,
+                    )
+
+    def record(
+        self,
+        test_type,
+        scheme,
+        opt_label,
+        mode,
+        status,
+        duration=None,
+        bin=None,
+        stderr=None,
+        message=None,
+        cached=False,
+    ):
+        """Record the result of a single test; stderr is bytes or str"""
+        if not self.enabled:
+            return
+        if isinstance(stderr, bytes):
+            stderr = stderr.decode(errors="replace")
+        cell = {
+            "test": str(test_type),
+            "desc": test_type.desc(),
+            "scheme": str(scheme),
+            "opt": opt_label,
+            "mode": mode,
+            "status": status,
+            "cached": cached,
+            "run_duration": duration,
+            "binary": bin,
+            "binary_sha256": (
+                sha256file(bin) if bin is not None and os.path.isfile(bin) else None
+            ),
+            "stderr": stderr[-self.EXCERPT :] if stderr else None,
+            "message": message,
+        }
+        with self.lock:
+            self.cells[(str(test_type), str(scheme), opt_label, mode)] = cell
+
+    def merge(self, fns):
+        """Combine the cells of reports written by --report, e.g. by the
+        shards of a test run, see `scripts/tests merge`. A cell fails if it
+        failed in any of the reports, and is skipped only if it was skipped
+        in all of them; durations are added up."""
+        self.enabled = True
+        for fn in fns:
+            with open(fn, "r") as f:
+                results = json.load(f)["results"]
+            compile_times = {}
+            for c in results:
+                key = (c["test"], c["opt"], c["mode"])
+                if c["compile_duration"] is not None:
+                    compile_times[key] = (c["compile_duration"], c["compile_success"])
+                cell = {
+                    k: v
+                    for k, v in c.items()
+                    if k not in ["compile_duration", "compile_success"]
+                }
+                with self.lock:
+                    key = (c["test"], c["scheme"], c["opt"], c["mode"])
+                    if key in self.cells:
+                        cell = self._merge_cells(self.cells[key], cell)
+                    self.cells[key] = cell
+            # Each report has its own make invocations
+            with self.lock:
+                for key, (duration, success) in compile_times.items():
+                    (d, s) = self.compile_times.get(key, (0.0, True))
+                    self.compile_times[key] = (d + duration, s and success)
+
+    def _merge_cells(self, a, b):
+        if b["status"] == "skipped":
+            return a
+        if a["status"] == "skipped":
+            return b
+        c = dict(a)
+        c["status"] = "fail" if "fail" in [a["status"], b["status"]] else "pass"
+        c["cached"] = a["cached"] and b["cached"]
+        if b["run_duration"] is not None:
+            c["run_duration"] = (a["run_duration"] or 0.0) + b["run_duration"]
+        stderr = "".join(x["stderr"] for x in [a, b] if x["stderr"])
+        c["stderr"] = stderr[-self.EXCERPT :] if stderr else None
+        c["message"] = "; ".join(x["message"] for x in [a, b] if x["message"]) or None
+        return c
+
+    def results(self):
+        with self.lock:
+            cells = [dict(c) for c in self.cells.values()]
+            for c in cells:
+                (duration, success) = self.compile_times.get(
+                    (c["test"], c["opt"], c["mode"]), (None, None)
+                )
+                c["compile_duration"] = duration
+                c["compile_success"] = success
+        return cells
+
+    def write_json(self, fn):
+        with open(fn, "w") as f:
+            json.dump({"argv": sys.argv[1:], "results": self.results()}, f, indent=2)
+
+    def write_junit(self, fn):
+        suites = ET.Element("testsuites")
+        groups = {}
+        for c in self.results():
+            groups.setdefault((c["mode"], c["opt"], c["desc"]), []).append(c)
+        for (mode, opt, desc), cells in groups.items():
+            suite = ET.SubElement(
+                suites,
+                "testsuite",
+                name=f"{mode} {opt} {desc}",
+                tests=str(len(cells)),
+                failures=str(sum(c["status"] == "fail" for c in cells)),
+                skipped=str(sum(c["status"] == "skipped" for c in cells)),
+                time=f"{sum(c['run_duration'] or 0 for c in cells):.3f}",
+            )
+            for c in cells:
+                case = ET.SubElement(
+                    suite,
+                    "testcase",
+                    classname=f"{mode}.{opt}.{c['test']}",
+                    name=c["scheme"],
+                    time=f"{c['run_duration'] or 0:.3f}",
+                )
+                if c["status"] == "fail":
+                    ET.SubElement(
+                        case, "failure", message=c["message"] or "failed"
+                    ).text = c["stderr"]
+                elif c["status"] == "skipped":
+                    ET.SubElement(case, "skipped", message=c["message"] or "")
+                elif c["stderr"]:
+                    ET.SubElement(case, "system-err").text = c["stderr"]
+        ET.ElementTree(suites).write(fn, encoding="unicode", xml_declaration=True)
+
+
+report = Report()
+
+
+def parse_meta(scheme, field, optional=False):
     with open("META.json", "r") as f:
         meta = json.load(f)
-    return meta["implementations"][int(scheme) - 1][field]
-
+    impl = meta["implementations"][int(scheme) - 1]
+    if optional:
+        return impl.get(field)
+    return impl[field]
+
+
+class ResultCache:
+    """Cache of test results
+
+    Results are keyed on the hash of the binary under test, the test type
+    and a digest of the test vectors, so a test only needs to be rerun if
+    one of them changes."""
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.lock = threading.Lock()
+        self.results = {}
+        if os.path.isfile(fn):
+            with open(fn, "r") as f:
+                self.results = json.load(f)
+
+    def key(self, bin, test_type, vectors):
+        if not os.path.isfile(bin):
+            return None
+        return f"{sha256file(bin)}:{test_type}:{vectors}"
+
+    def passed(self, key):
+        with self.lock:
+            return key is not None and self.results.get(key) == "pass"
+
+    def record(self, key, passed):
+        if key is None:
+            return
+        with self.lock:
+            self.results[key] = "pass" if passed else "fail"
+            os.makedirs(os.path.dirname(self.fn) or ".", exist_ok=True)
+            tmp = f"{self.fn}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.results, f, indent=2)
+            os.replace(tmp, self.fn)
+
+
+class Summary:
+    """Test results for the GitHub CI step summary
+
+    Results are accumulated in memory, and rendered to the file given by
+    GITHUB_STEP_SUMMARY once at exit. Results under a title which is
+    already in the file, e.g. from an earlier invocation in the same step,
+    are added to its table."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sections = {}
+
+    @staticmethod
+    def header():
+        return [
+            "| Tests |" + "".join(f" {s} |" for s in SCHEME),
+            "| ----- |" + " ----- |" * len(SCHEME),
+        ]
 
-def github_summary(title, test_label, results):
-    """Generate summary for GitHub CI"""
-    summary_file = os.environ.get("GITHUB_STEP_SUMMARY")
-
-    res = list(results.values())
-
-    if isinstance(results[SCHEME.MLKEM512], str):
-        summaries = list(
-            map(
-                lambda s: f" {s} |",
-                reduce(
-                    lambda acc, s: [
-                        line1 + " | " + line2 for line1, line2 in zip(acc, s)
-                    ],
-                    [s.splitlines() for s in res],
-                ),
+    @staticmethod
+    def rows(test_label, results):
+        """Table rows of the results of a test for all parameter sets;
+        results are booleans indicating failure, None for skipped tests,
+        or multi-line strings"""
+        res = list(results.values())
+
+        if isinstance(results[SCHEME.MLKEM512], str):
+            summaries = list(
+                map(
+                    lambda s: f" {s} |",
+                    reduce(
+                        lambda acc, s: [
+                            line1 + " | " + line2 for line1, line2 in zip(acc, s)
+                        ],
+                        [s.splitlines() for s in res],
+                    ),
+                )
             )
-        )
-        summaries = [f"| {test_label} |" + summaries[0]] + [
-            "| |" + x for x in summaries[1:]
-        ]
-    else:
-        summaries = [
+            return [f"| {test_label} |" + summaries[0]] + [
+                "| |" + x for x in summaries[1:]
+            ]
+
+        return [
             reduce(
-                lambda acc, b: f"{acc} " + (":x: |" if b else ":white_check_mark: |"),
+                lambda acc, b: f"{acc} "
+                + (
+                    ":heavy_minus_sign: |"
+                    if b is None
+                    else ":x: |" if b else ":white_check_mark: |"
+                ),
                 res,
                 f"| {test_label} |",
             )
         ]
 
-    def find_last_consecutive_match(l, s):
-        for i, v in enumerate(l[s + 1 :]):
-            if not v.startswith("|") or not v.endswith("|"):
-                return i + 1
-        return len(l)
-
-    def add_summaries(fn, title, summaries):
-        summary_title = "| Tests |"
-        summary_table_format = "| ----- |"
-        for s in SCHEME:
-            summary_title += f" {s} |"
-            summary_table_format += " ----- |"
-
-        with open(fn, "r") as f:
-            pre_summaries = [x for x in f.read().splitlines() if x]
-            if title in pre_summaries:
-                if summary_title not in pre_summaries:
-                    summaries = [summary_title, summary_table_format] + summaries
-                    pre_summaries = (
-                        pre_summaries[: pre_summaries.index(title) + 1]
-                        + summaries
-                        + pre_summaries[pre_summaries.index(title) + 1 :]
-                    )
-                else:
-                    i = find_last_consecutive_match(
-                        pre_summaries, pre_summaries.index(title)
-                    )
-                    pre_summaries = pre_summaries[:i] + summaries + pre_summaries[i:]
-                return ("w", pre_summaries)
-            else:
-                pre_summaries = [
-                    title,
-                    summary_title,
-                    summary_table_format,
-                ] + summaries
-                return ("a", pre_summaries)
-
-    if summary_file is not None:
-        (access_mode, summaries) = add_summaries(summary_file, title, summaries)
-        with open(summary_file, access_mode) as f:
-            print("\n".join(summaries), file=f)
+    def record(self, title, test_label, results):
+        rows = self.rows(test_label, results)
+        with self.lock:
+            if len(self.sections) == 0:
+                atexit.register(self.write)
+            self.sections.setdefault(title, []).extend(rows)
+
+    def render(self, lines):
+        """Merge the accumulated results into the lines of a summary"""
+        lines = list(lines)
+        header = self.header()
+        for title, rows in self.sections.items():
+            if title not in lines:
+                lines += [title] + header + rows
+                continue
+            # Insert after the table following the title
+            i = lines.index(title) + 1
+            if lines[i : i + 2] != header:
+                lines[i:i] = header
+            i += 2
+            while i < len(lines) and lines[i].startswith("|"):
+                i += 1
+            lines[i:i] = rows
+        return lines
+
+    def write(self):
+        fn = os.environ.get("GITHUB_STEP_SUMMARY")
+        if fn is None:
+            return
+        with tracer.span("github_summary", "summary"), self.lock:
+            lines = []
+            if os.path.isfile(fn):
+                with open(fn, "r") as f:
+                    lines = [x for x in f.read().splitlines() if x]
+            with open(fn, "w") as f:
+                print("\n".join(self.render(lines)), file=f)
+
+
+summary = Summary()
+
+
+def github_summary(title, test_label, results):
+    """Record results for the GitHub CI step summary, see Summary"""
+    summary.record(title, test_label, results)
 
 
 logging.basicConfig(
@@ -0,0 +1,156 @@
+# Copyright (c) 2024 The mlkem-native project authors
+# SPDX-License-Identifier: Apache-2.0
+
+# File system watchers for `scripts/tests watch`
+#
+# On Linux, directories are watched via inotify, accessed through ctypes
+# so that no extra Python packages are needed. Elsewhere, or if inotify is
+# not available, the directories are polled for changes in modification
+# time and size.
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+
+IN_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+# struct inotify_event, without the trailing name
+_EVENT = struct.Struct("iIII")
+
+
+def _excluded(p, exclude):
+    return any(p == e or p.startswith(e + os.sep) for e in exclude)
+
+
+def _walk(dirs, exclude):
+    """Yield (directory, files) for all directories below `dirs`"""
+    for d in dirs:
+        for root, subdirs, files in os.walk(d):
+            subdirs[:] = [
+                s for s in subdirs if not _excluded(os.path.join(root, s), exclude)
+            ]
+            yield (root, files)
+
+
+class InotifyWatcher:
+    """Watch directories recursively via inotify(7)"""
+
+    def __init__(self, dirs, exclude):
+        self.exclude = [os.path.normpath(e) for e in exclude]
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.dirs = dirs
+        self.wds = {}
+        for root, _ in _walk(dirs, self.exclude):
+            self._add(root)
+
+    def _add(self, d):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(d), IN_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch {d} failed")
+        self.wds[wd] = d
+
+    def _add_tree(self, d, changed):
+        """Watch `d` and the directories below it, and report the files
+        they already hold as changed. Directories which disappear before
+        they are watched are skipped."""
+        for root, files in _walk([d], self.exclude):
+            try:
+                self._add(root)
+            except OSError:
+                continue
+            changed.update(os.path.join(root, f) for f in files)
+
+    def _read(self, changed):
+        buf = os.read(self.fd, 1 << 16)
+        i = 0
+        while i < len(buf):
+            (wd, mask, _, n) = _EVENT.unpack_from(buf, i)
+            name = os.fsdecode(buf[i + _EVENT.size : i + _EVENT.size + n].rstrip(b"\0"))
+            i += _EVENT.size + n
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, e.g. on a checkout touching many files,
+                # so rescan everything and treat all files as changed
+                for d in self.dirs:
+                    self._add_tree(d, changed)
+                continue
+            if wd not in self.wds:
+                continue
+            p = os.path.join(self.wds[wd], name)
+            if _excluded(p, self.exclude):
+                continue
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # Watch the new directory and report what it already holds
+                    self._add_tree(p, changed)
+                continue
+            changed.add(p)
+
+    def wait(self, settle=0.05):
+        """Block until files changed, and return their paths once no
+        further changes arrived for `settle` seconds"""
+        changed = set()
+        while len(changed) == 0:
+            select.select([self.fd], [], [])
+            self._read(changed)
+            while select.select([self.fd], [], [], settle)[0]:
+                self._read(changed)
+        return changed
+
+
+class PollingWatcher:
+    """Watch directories recursively by polling"""
+
+    def __init__(self, dirs, exclude, interval=0.25):
+        self.dirs = dirs
+        self.exclude = [os.path.normpath(e) for e in exclude]
+        self.interval = interval
+        self.state = self._scan()
+
+    def _scan(self):
+        state = {}
+        for root, files in _walk(self.dirs, self.exclude):
+            for f in files:
+                p = os.path.join(root, f)
+                try:
+                    st = os.stat(p)
+                except FileNotFoundError:
+                    continue
+                state[p] = (st.st_mtime_ns, st.st_size)
+        return state
+
+    def wait(self, settle=0.05):
+        """Block until files changed, and return their paths"""
+        while True:
+            time.sleep(self.interval)
+            state = self._scan()
+            changed = {
+                p
+                for p in state.keys() | self.state.keys()
+                if state.get(p) != self.state.get(p)
+            }
+            self.state = state
+            if changed:
+                return changed
+
+
+def watcher(dirs, exclude):
+    """Return an inotify watcher for `dirs` if possible, and a polling
+    watcher otherwise. Paths below `exclude` are ignored."""
+    try:
+        return InotifyWatcher(dirs, exclude)
+    except (OSError, AttributeError):
+        return PollingWatcher(dirs, exclude)
@@ -6,26 +6,48 @@
 # Processes 'internalProjection.json' files from
 # https://github.com/usnistgov/ACVP-Server/blob/master/gen-val/json-files
 #
-# Invokes `acvp_mlkem{lvl}` under the hood.
+# Invokes `acvp_mlkem{lvl}` under the hood, using a single long-lived
+# batch process per parameter set and thread.
+#
+# Alternatively, test vectors can be compiled into a binary store once
+# (--compile-store) and be run from there (--store), avoiding JSON and
+# hex processing altogether. See acvp_store.py for the format.
+#
+# With --ffi, test vectors are instead run in-process through the shared
+# libraries built by `make shared_lib`, see scripts/lib/mlkem_ffi.py.
+#
+# With --latency, the wall time of every test vector is recorded, split
+# into the phases
+#
+# - launch:  starting the worker, including EXEC_WRAPPER (first vector
+#            of a worker only)
+# - compute: time spent in the KEM, as reported by the worker
+# - io:      remaining request round trip, i.e. hex encoding and decoding,
+#            pipe transfer and request parsing
+# - compare: comparison of results against the expected values
+#
+# and summarized per parameter set and function at the end.
 
 import os
 import json
 import sys
+import argparse
 import subprocess
+import threading
+import time
+from acvp_store import MODES, FIELDS, ACVPStore, write_store
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "scripts", "lib"))
+from acvp_vectors import json_files, iter_test_groups
 
 # Check if we need to use a wrapper for execution (e.g. QEMU)
 exec_prefix = os.environ.get("EXEC_WRAPPER", "")
 exec_prefix = [exec_prefix] if exec_prefix != "" else []
 
 acvp_dir = "test/acvp_data"
-acvp_keygen_json = f"{acvp_dir}/acvp_keygen_internalProjection.json"
-acvp_encapDecap_json = f"{acvp_dir}/acvp_encapDecap_internalProjection.json"
-
-with open(acvp_keygen_json, "r") as f:
-    acvp_keygen_data = json.load(f)
-
-with open(acvp_encapDecap_json, "r") as f:
-    acvp_encapDecap_data = json.load(f)
+build_dir = "test/build"
 
 
 def err(msg, **kwargs):
@@ -36,101 +58,528 @@ def info(msg, **kwargs):
     print(msg, **kwargs)
 
 
-def get_acvp_binary(tg):
-    """Convert JSON dict for ACVP test group to suitable ACVP binary."""
+def get_acvp_binary(parameter_set):
+    """Convert ACVP parameter set to suitable ACVP binary."""
     parameterSetToLevel = {
         "ML-KEM-512": 512,
         "ML-KEM-768": 768,
         "ML-KEM-1024": 1024,
     }
-    level = parameterSetToLevel[tg["parameterSet"]]
-    basedir = f"./test/build/mlkem{level}/bin"
+    level = parameterSetToLevel[parameter_set]
+    basedir = f"{build_dir}/mlkem{level}/bin"
     acvp_bin = f"acvp_mlkem{level}"
     return f"{basedir}/{acvp_bin}"
 
 
+class ACVPWorker:
+    """Long-lived `acvp_mlkem{lvl} batch [STORE]` process
+
+    Requests are written to the worker's stdin, one per line. The worker
+    answers each request with lines of the form `key=HEX`, terminated by
+    an empty line."""
+
+    def __init__(self, acvp_bin, store=None, timed=False):
+        self.acvp_call = exec_prefix + [acvp_bin, "batch"]
+        if timed:
+            self.acvp_call.append("-t")
+        if store is not None:
+            self.acvp_call.append(store)
+        self.proc = subprocess.Popen(
+            self.acvp_call,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            encoding="utf-8",
+        )
+        self.compute_ns = 0
+        # A timed worker signals readiness with an empty line, so that
+        # startup is accounted for as launch time
+        if timed:
+            self.proc.stdout.readline()
+
+    def run(self, args):
+        """Process a single request and return the results as a dict
+
+        Returns None if the worker terminated before answering."""
+        try:
+            self.proc.stdin.write(" ".join(args) + "\n")
+            self.proc.stdin.flush()
+        except BrokenPipeError:
+            return None
+        results = {}
+        while True:
+            l = self.proc.stdout.readline()
+            if l == "":
+                return None
+            l = l.rstrip("\n")
+            if l == "":
+                if "time_ns" in results:
+                    self.compute_ns = int(results.pop("time_ns"))
+                return results
+            (k, v) = l.split("=")
+            results[k] = v
+
+    def fail(self, args):
+        """Return error messages describing the termination of the worker"""
+        self.proc.stdin.close()
+        returncode = self.proc.wait()
+        return [
+            f"{self.acvp_call} failed on {args} with error code {returncode}",
+            self.proc.stderr.read(),
+        ]
+
+    def close(self):
+        self.proc.stdin.close()
+        self.proc.wait()
+
+
+class FFIWorker:
+    """In-process alternative to ACVPWorker
+
+    Processes the same requests as `acvp_mlkem{lvl} batch [STORE]`, but
+    calls into lib<scheme>.so via mlkem_ffi instead of a subprocess."""
+
+    def __init__(self, parameter_set, store=None):
+        self.kem = mlkem_ffi.load(parameter_set, build_dir)
+        self.store = ACVPStore(store) if store is not None else None
+        self.error = None
+        self.compute_ns = 0
+
+    def _run(self, args):
+        if args[0] == "stored":
+            entry = self.store.entry(int(args[1]))
+            (inputs, outputs) = FIELDS[entry.group.function]
+            x = {f: self.store.field(entry, f) for f in inputs}
+        else:
+            x = {
+                k: bytes.fromhex(v) for k, v in (a.split("=") for a in args if "=" in a)
+            }
+            outputs = None
+
+        t0 = time.perf_counter_ns()
+        if "z" in x:
+            (ek, dk) = self.kem.crypto_kem_keypair_derand(x["d"] + x["z"])
+            results = {"ek": ek, "dk": dk}
+        elif "m" in x:
+            (c, k) = self.kem.crypto_kem_enc_derand(x["ek"], x["m"])
+            results = {"c": c, "k": k}
+        else:
+            results = {"k": self.kem.crypto_kem_dec(x["c"], x["dk"])}
+        self.compute_ns = time.perf_counter_ns() - t0
+
+        # For stored test cases, only report mismatching fields
+        if outputs is not None:
+            results = {
+                f: v for f, v in results.items() if v != self.store.field(entry, f)
+            }
+        return {k: v.hex().upper() for k, v in results.items()}
+
+    def run(self, args):
+        """Process a single request and return the results as a dict
+
+        Returns None if the request could not be processed."""
+        try:
+            return self._run(args)
+        except Exception as e:
+            self.error = e
+            return None
+
+    def fail(self, args):
+        return [f"{self.kem.parameter_set} failed on {args}: {self.error}"]
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+
+
+# Whether to run test vectors in-process, see FFIWorker
+use_ffi = False
+# Imported with --ffi only, see main()
+mlkem_ffi = None
+
+LATENCY_PHASES = ["launch", "compute", "io", "compare"]
+PERCENTILES = [50, 90, 99]
+
+
+class LatencyStats:
+    """Per-vector latencies in ns, by parameter set, function and phase"""
+
+    def __init__(self):
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def record(self, parameter_set, function, phases):
+        with self.lock:
+            s = self.samples.setdefault((parameter_set, function), {})
+            for phase, ns in phases.items():
+                s.setdefault(phase, []).append(ns)
+            s.setdefault("total", []).append(sum(phases.values()))
+
+    @staticmethod
+    def _percentile(xs, p):
+        """Nearest-rank percentile of a sorted list"""
+        return xs[max(0, -(-p * len(xs) // 100) - 1)]
+
+    @staticmethod
+    def _histogram(xs):
+        """Counts per power-of-two bucket of microseconds, as a list of
+        (upper bound in us, count)"""
+        buckets = {}
+        for x in xs:
+            le = 1
+            while le * 1000 < x:
+                le *= 2
+            buckets[le] = buckets.get(le, 0) + 1
+        return sorted(buckets.items())
+
+    def summary(self):
+        """Summary as a JSON-serializable dict, with times in us"""
+        res = {}
+        for (parameter_set, function), s in sorted(self.samples.items()):
+            phases = {}
+            for phase in LATENCY_PHASES + ["total"]:
+                xs = sorted(s[phase])
+                phases[phase] = {
+                    "mean": sum(xs) / len(xs) / 1000,
+                    "min": xs[0] / 1000,
+                    **{f"p{p}": self._percentile(xs, p) / 1000 for p in PERCENTILES},
+                    "max": xs[-1] / 1000,
+                    "sum": sum(xs) / 1000,
+                }
+            res.setdefault(parameter_set, {})[function] = {
+                "count": len(s["total"]),
+                "phases": phases,
+                "histogram": [
+                    {"le_us": le, "count": n} for le, n in self._histogram(s["total"])
+                ],
+            }
+        return res
+
+    def print_summary(self):
+        cols = ["mean", "min"] + [f"p{p}" for p in PERCENTILES] + ["max"]
+        for parameter_set, functions in self.summary().items():
+            for function, r in functions.items():
+                info(f"\n{parameter_set} {function}: {r['count']} test vectors")
+                info(f"  {'[us]':<8}" + "".join(f"{c:>10}" for c in cols))
+                for phase, stats in r["phases"].items():
+                    info(f"  {phase:<8}" + "".join(f"{stats[c]:>10.1f}" for c in cols))
+                info("  Histogram of total latency:")
+                width = max(h["count"] for h in r["histogram"])
+                for h in r["histogram"]:
+                    bar = "#" * max(1, 40 * h["count"] // width)
+                    le = f"<= {h['le_us']}us"
+                    info(f"  {le:>12} {h['count']:>8} {bar}")
+
+
+# Latency statistics, if enabled via --latency
+latency = None
+
+# One worker per ACVP binary (i.e. per parameter set) and thread
+workers = threading.local()
+all_workers = []
+all_workers_lock = threading.Lock()
+
+
+def get_acvp_worker(parameter_set, store=None):
+    """Get (or start) the calling thread's ACVP worker for a parameter set."""
+    if not hasattr(workers, "by_bin"):
+        workers.by_bin = {}
+    acvp_bin = get_acvp_binary(parameter_set)
+    if acvp_bin not in workers.by_bin:
+        if use_ffi:
+            worker = FFIWorker(parameter_set, store)
+        else:
+            worker = ACVPWorker(acvp_bin, store, timed=latency is not None)
+        workers.by_bin[acvp_bin] = worker
+        with all_workers_lock:
+            all_workers.append(worker)
+    return workers.by_bin[acvp_bin]
+
+
+def run_acvp_request(parameter_set, function, args, expect, store=None):
+    """Run a single ACVP request and compare results to the expected data.
+
+    `expect` maps the name of a result field to its expected hex value.
+    Returns None on success, and a list of error messages otherwise."""
+    t0 = time.perf_counter_ns()
+    worker = get_acvp_worker(parameter_set, store)
+    t1 = time.perf_counter_ns()
+    results = worker.run(args)
+    t2 = time.perf_counter_ns()
+    if results is None:
+        # Start a fresh worker for subsequent requests, see --keep-going
+        del workers.by_bin[get_acvp_binary(parameter_set)]
+        return worker.fail(args)
+    errors = [
+        f"Mismatching result for {k}: expected {expect(k)}, got {v}"
+        for k, v in results.items()
+        if v != expect(k)
+    ] or None
+    t3 = time.perf_counter_ns()
+    if latency is not None:
+        latency.record(
+            parameter_set,
+            function,
+            {
+                "launch": t1 - t0,
+                "compute": worker.compute_ns,
+                "io": t2 - t1 - worker.compute_ns,
+                "compare": t3 - t2,
+            },
+        )
+    return errors
+
+
 def run_encapDecap_test(tg, tc):
-    info(f"Running encapDecap test case {tc['tcId']} ({tg['function']}) ... ", end="")
     if tg["function"] == "encapsulation":
-        acvp_bin = get_acvp_binary(tg)
-        acvp_call = exec_prefix + [
-            acvp_bin,
+        args = [
             "encapDecap",
             "AFT",
             "encapsulation",
             f"ek={tc['ek']}",
             f"m={tc['m']}",
         ]
-        result = subprocess.run(acvp_call, encoding="utf-8", capture_output=True)
-        if result.returncode != 0:
-            err("FAIL!")
-            err(f"{acvp_call} failed with error code {result.returncode}")
-            err(result.stderr)
-            exit(1)
-        # Extract results and compare to expected data
-        for l in result.stdout.splitlines():
-            (k, v) = l.split("=")
-            if v != tc[k]:
-                err("FAIL!")
-                err(f"Mismatching result for {k}: expected {tc[k]}, got {v}")
-                exit(1)
-        info("OK")
     elif tg["function"] == "decapsulation":
-        acvp_bin = get_acvp_binary(tg)
-        acvp_call = exec_prefix + [
-            acvp_bin,
+        args = [
             "encapDecap",
             "VAL",
             "decapsulation",
             f"dk={tg['dk']}",
             f"c={tc['c']}",
         ]
-        result = subprocess.run(acvp_call, encoding="utf-8", capture_output=True)
-        if result.returncode != 0:
-            err("FAIL!")
-            err(f"{acvp_call} failed with error code {result.returncode}")
-            err(result.stderr)
-            exit(1)
-        # Extract results and compare to expected data
-        for l in result.stdout.splitlines():
-            (k, v) = l.split("=")
-            if v != tc[k]:
-                err("FAIL!")
-                err(f"Mismatching result for {k}: expected {tc[k]}, got {v}")
-                exit(1)
-        info("OK")
+    return run_acvp_request(tg["parameterSet"], tg["function"], args, lambda k: tc[k])
 
 
 def run_keyGen_test(tg, tc):
-    info(f"Running keyGen test case {tc['tcId']} ... ", end="")
-    acvp_bin = get_acvp_binary(tg)
-    acvp_call = exec_prefix + [
-        acvp_bin,
+    args = [
         "keyGen",
         "AFT",
         f"z={tc['z']}",
         f"d={tc['d']}",
     ]
-    result = subprocess.run(acvp_call, encoding="utf-8", capture_output=True)
-    if result.returncode != 0:
-        err("FAIL!")
-        err(f"{acvp_call} failed with error code {result.returncode}")
-        err(result.stderr)
-        exit(1)
-    # Extract results and compare to expected data
-    for l in result.stdout.splitlines():
-        (k, v) = l.split("=")
-        if v != tc[k]:
+    return run_acvp_request(tg["parameterSet"], "keyGen", args, lambda k: tc[k])
+
+
+def run_stored_test(store, entry):
+    """Run a test case from a binary store. The worker compares the results
+    itself and only reports mismatching fields."""
+    return run_acvp_request(
+        entry.group.parameterSet,
+        entry.group.function,
+        ["stored", str(entry.index)],
+        lambda k: store.field(entry, k).hex().upper(),
+        store.path,
+    )
+
+
+def describe_test(mode, function, tcId):
+    if mode == "keyGen":
+        return f"keyGen test case {tcId}"
+    return f"encapDecap test case {tcId} ({function})"
+
+
+def parse_tc_range(s):
+    """Parse a tcId range of the form N or N-M"""
+    (lo, _, hi) = s.partition("-")
+    return (int(lo), int(hi if hi != "" else lo))
+
+
+def iter_json_groups(acvp_dir, modes, parameter_sets, tc_range):
+    """Yield (mode, test group) for the selected test groups in the
+    internalProjection files, restricted to test cases in tc_range."""
+    for mode in MODES:
+        if mode not in modes:
+            continue
+        for tg in iter_test_groups(f"{acvp_dir}/{json_files[mode]}"):
+            if parameter_sets is not None and tg["parameterSet"] not in parameter_sets:
+                continue
+            if tc_range is not None:
+                tg["tests"] = [
+                    tc for tc in tg["tests"] if tc_range[0] <= tc["tcId"] <= tc_range[1]
+                ]
+            yield (mode, tg)
+
+
+def ordered_map(f, xs, jobs):
+    """Apply f to all elements of xs, using up to `jobs` threads
+
+    Results are yielded in the order of xs. Only a bounded number of
+    elements is in flight at any time, so xs may be a lazy stream."""
+    if jobs <= 1:
+        yield from map(f, xs)
+        return
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        for x in xs:
+            pending.append(executor.submit(f, x))
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def run_tests(
+    acvp_dir, store_file, modes, parameter_sets, tc_range, jobs, keep_going=False
+):
+    def json_tests():
+        for mode, tg in iter_json_groups(acvp_dir, modes, parameter_sets, tc_range):
+            run = run_keyGen_test if mode == "keyGen" else run_encapDecap_test
+            for tc in tg["tests"]:
+                desc = describe_test(mode, tg.get("function"), tc["tcId"])
+                yield (desc, lambda tg=tg, tc=tc, run=run: run(tg, tc))
+
+    def stored_tests(store):
+        # Report in the same order as for the internalProjection files
+        entries = sorted(
+            store.select(modes, parameter_sets, tc_range),
+            key=lambda e: (MODES.index(e.group.mode), e.tcId),
+        )
+        for e in entries:
+            desc = describe_test(e.group.mode, e.group.function, e.tcId)
+            yield (desc, lambda e=e: run_stored_test(store, e))
+
+    def run_test(test):
+        (desc, run) = test
+        return (desc, run())
+
+    store = ACVPStore(store_file) if store_file is not None else None
+    tests = json_tests() if store is None else stored_tests(store)
+
+    failures = []
+    results = ordered_map(run_test, tests, jobs)
+    for desc, errors in results:
+        info(f"Running {desc} ... ", end="")
+        if errors is None:
+            info("OK")
+        else:
             err("FAIL!")
-            err(f"Mismatching result for {k}: expected {tc[k]}, got {v}")
-            exit(1)
-    info("OK")
+            for e in errors:
+                err(e)
+            failures.append((desc, errors))
+            if not keep_going:
+                break
+
+    # Wait for test cases still in flight before shutting down the workers
+    results.close()
+    for worker in all_workers:
+        worker.close()
+    if store is not None:
+        store.close()
 
+    if keep_going and failures:
+        err(f"{len(failures)} test cases failed:")
+        for desc, errors in failures:
+            err(f"- {desc}: {errors[0]}")
+
+    return len(failures) > 0
+
+
+def cli():
+    global use_ffi, latency, build_dir, mlkem_ffi
+
+    parser = argparse.ArgumentParser(description="ACVP client for ML-KEM")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of test cases to process in parallel",
+    )
+    parser.add_argument(
+        "-d",
+        "--acvp-dir",
+        default=acvp_dir,
+        help="Directory containing the ACVP internalProjection files",
+    )
+    parser.add_argument(
+        "--build-dir",
+        default=build_dir,
+        help="Build directory containing the acvp_mlkem{lvl} binaries",
+    )
+    parser.add_argument(
+        "--mode",
+        choices=["encapDecap", "keyGen"],
+        action="append",
+        help="ACVP mode to test; can be given multiple times (default: all)",
+    )
+    parser.add_argument(
+        "--param",
+        choices=["ML-KEM-512", "ML-KEM-768", "ML-KEM-1024"],
+        action="append",
+        help="Parameter set to test; can be given multiple times (default: all)",
+    )
+    parser.add_argument(
+        "--tc",
+        type=parse_tc_range,
+        help="Range of test case IDs to test, of the form N or N-M (inclusive)",
+    )
+    parser.add_argument(
+        "--store",
+        help="Run test vectors from a binary store instead of the "
+        "internalProjection files",
+    )
+    parser.add_argument(
+        "--compile-store",
+        metavar="STORE",
+        help="Compile the selected test vectors into a binary store and exit",
+    )
+    parser.add_argument(
+        "--ffi",
+        action="store_true",
+        help="Run test vectors in-process via the shared libraries built by "
+        "`make shared_lib`, instead of via acvp_mlkem{lvl}",
+    )
+    parser.add_argument(
+        "-k",
+        "--keep-going",
+        action="store_true",
+        help="Run all test cases, and report all failures at the end, "
+        "instead of stopping at the first failure",
+    )
+    parser.add_argument(
+        "--latency",
+        nargs="?",
+        const="-",
+        metavar="FILE",
+        help="Record per-vector latencies and print a summary, or write it "
+        "as JSON to FILE",
+    )
+    args = parser.parse_args()
+
+    use_ffi = args.ffi
+    build_dir = args.build_dir
+    if use_ffi:
+        import mlkem_ffi
+    if args.latency is not None:
+        latency = LatencyStats()
+
+    modes = args.mode if args.mode is not None else MODES
+    if args.compile_store is not None:
+        write_store(
+            args.compile_store,
+            iter_json_groups(args.acvp_dir, modes, args.param, args.tc),
+        )
+        return
+
+    fail = run_tests(
+        args.acvp_dir,
+        args.store,
+        modes,
+        args.param,
+        args.tc,
+        args.jobs,
+        args.keep_going,
+    )
+
+    if args.latency == "-":
+        latency.print_summary()
+    elif args.latency is not None:
+        with open(args.latency, "w") as f:
+            json.dump(latency.summary(), f, indent=2)
+
+    if fail:
+        exit(1)
 
-for tg in acvp_encapDecap_data["testGroups"]:
-    for tc in tg["tests"]:
-        run_encapDecap_test(tg, tc)
 
-for tg in acvp_keygen_data["testGroups"]:
-    for tc in tg["tests"]:
-        run_keyGen_test(tg, tc)
+if __name__ == "__main__":
+    cli()
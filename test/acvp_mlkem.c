@@ -2,18 +2,49 @@
  * Copyright (c) 2024 The mlkem-native project authors
  * SPDX-License-Identifier: Apache-2.0
  */
+#if !defined(_POSIX_C_SOURCE)
+/* Ensure that mmap() is declared even when compiling with -std=c99 */
+#define _POSIX_C_SOURCE 200112L
+#endif
+
+#include <fcntl.h>
 #include <stddef.h>
+#include <stdint.h>
 #include <stdio.h>
+#include <stdlib.h>
 #include <string.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <time.h>
+#include <unistd.h>
 #include "kem.h"
 #include "randombytes.h"
 
 #define USAGE \
   "acvp_mlkem{lvl} [encapDecap|keyGen] [AFT|VAL] {test specific arguments}"
+#define BATCH_USAGE \
+  "acvp_mlkem{lvl} batch [-t] [STORE] < {one request per line}"
+#define STORED_USAGE "stored ENTRY (in batch mode with STORE only)"
 #define ENCAPS_USAGE "acvp_mlkem{lvl} encapDecap AFT encaps ek=HEX m=HEX"
 #define DECAPS_USAGE "acvp_mlkem{lvl} encapDecap VAL decaps dk=HEX c=HEX"
 #define KEYGEN_USAGE "acvp_mlkem{lvl} keyGen AFT z=HEX d=HEX"
 
+/*
+ * Maximum length of a request line in batch mode. The longest request
+ * is decapsulation, which carries hex encodings of dk and c.
+ */
+#define MAX_LINE_LENGTH \
+  (2 * (MLKEM_SECRETKEYBYTES + MLKEM_CIPHERTEXTBYTES) + 64)
+#define MAX_ARGS 8
+
+/*
+ * Binary store of test vectors, as written by test/acvp_store.py.
+ * All integers are little endian.
+ */
+#define STORE_MAGIC "MLKACVP1"
+#define STORE_HEADER_BYTES 32
+#define STORE_ENTRY_BYTES 24
+
 typedef enum
 {
   encapDecap,
@@ -32,6 +63,32 @@ typedef enum
   decapsulation
 } acvp_encapDecap_function;
 
+typedef enum
+{
+  store_keyGen,
+  store_encapsulation,
+  store_decapsulation
+} acvp_store_function;
+
+static const unsigned char *store_data = NULL;
+static uint64_t store_len;
+static uint64_t store_num_entries;
+static uint64_t store_entries_offset;
+
+/*
+ * With `batch -t`, the time spent in the function under test is reported
+ * as `time_ns=N` after the results of each request.
+ */
+static int report_time = 0;
+static uint64_t compute_ns;
+
+static uint64_t now_ns(void)
+{
+  struct timespec ts;
+  clock_gettime(CLOCK_MONOTONIC, &ts);
+  return (uint64_t)ts.tv_sec * 1000000000u + (uint64_t)ts.tv_nsec;
+}
+
 /* Decode hex character [0-9A-Fa-f] into 0-15 */
 static unsigned char decode_hex_char(char hex)
 {
@@ -119,8 +176,11 @@ static void acvp_mlkem_encapDecp_AFT_encapsulation(
 {
   unsigned char ct[MLKEM_CIPHERTEXTBYTES];
   unsigned char ss[MLKEM_SSBYTES];
+  uint64_t t0;
 
+  t0 = now_ns();
   crypto_kem_enc_derand(ct, ss, ek, m);
+  compute_ns = now_ns() - t0;
 
   print_hex("c", ct, sizeof(ct));
   print_hex("k", ss, sizeof(ss));
@@ -131,8 +191,11 @@ static void acvp_mlkem_encapDecp_VAL_decapsulation(
     unsigned char const c[MLKEM_CIPHERTEXTBYTES])
 {
   unsigned char ss[MLKEM_SSBYTES];
+  uint64_t t0;
 
+  t0 = now_ns();
   crypto_kem_dec(ss, c, dk);
+  compute_ns = now_ns() - t0;
 
   print_hex("k", ss, sizeof(ss));
 }
@@ -144,26 +207,24 @@ static void acvp_mlkem_keyGen_AFT(unsigned char const z[MLKEM_SYMBYTES],
   unsigned char dk[MLKEM_SECRETKEYBYTES];
 
   unsigned char zd[2 * MLKEM_SYMBYTES];
+  uint64_t t0;
   memcpy(zd, d, MLKEM_SYMBYTES);
   memcpy(zd + MLKEM_SYMBYTES, z, MLKEM_SYMBYTES);
 
+  t0 = now_ns();
   crypto_kem_keypair_derand(ek, dk, zd);
+  compute_ns = now_ns() - t0;
 
   print_hex("ek", ek, sizeof(ek));
   print_hex("dk", dk, sizeof(dk));
 }
 
-int main(int argc, char *argv[])
+/* Process a single request, given as arguments without the program name */
+static int acvp_request(int argc, char *argv[])
 {
   acvp_mode mode;
   acvp_type type;
 
-  if (argc == 0)
-  {
-    goto usage;
-  }
-  argc--, argv++;
-
   /* Parse mode: "encapDecap" or "keyGen" */
   if (argc == 0)
   {
@@ -341,3 +402,299 @@ keygen_usage:
   fprintf(stderr, KEYGEN_USAGE "\n");
   return (1);
 }
+
+static uint32_t load32_le(const unsigned char *p)
+{
+  return (uint32_t)p[0] | ((uint32_t)p[1] << 8) | ((uint32_t)p[2] << 16) |
+         ((uint32_t)p[3] << 24);
+}
+
+static uint64_t load64_le(const unsigned char *p)
+{
+  return (uint64_t)load32_le(p) | ((uint64_t)load32_le(p + 4) << 32);
+}
+
+static int store_open(const char *path)
+{
+  int fd;
+  struct stat st;
+  void *data;
+
+  fd = open(path, O_RDONLY);
+  if (fd < 0)
+  {
+    perror(path);
+    return (1);
+  }
+  if (fstat(fd, &st) != 0)
+  {
+    perror(path);
+    close(fd);
+    return (1);
+  }
+  if ((size_t)st.st_size < STORE_HEADER_BYTES)
+  {
+    close(fd);
+    goto invalid;
+  }
+
+  data = mmap(NULL, (size_t)st.st_size, PROT_READ, MAP_PRIVATE, fd, 0);
+  if (data == MAP_FAILED)
+  {
+    perror(path);
+    close(fd);
+    return (1);
+  }
+  close(fd);
+
+  store_data = (const unsigned char *)data;
+  store_len = (uint64_t)st.st_size;
+  store_num_entries = load32_le(store_data + 12);
+  store_entries_offset = load64_le(store_data + 24);
+
+  if (memcmp(store_data, STORE_MAGIC, strlen(STORE_MAGIC)) != 0 ||
+      store_entries_offset > store_len ||
+      store_num_entries >
+          (store_len - store_entries_offset) / STORE_ENTRY_BYTES)
+  {
+    goto invalid;
+  }
+  return (0);
+
+invalid:
+  fprintf(stderr, "%s is not a valid ACVP store\n", path);
+  return (1);
+}
+
+/* Print the actual value of a field if it differs from the expected one */
+static void check_field(const char *name, const unsigned char *actual,
+                        const unsigned char *expected, size_t len)
+{
+  if (memcmp(actual, expected, len) != 0)
+  {
+    print_hex(name, actual, len);
+  }
+}
+
+/*
+ * Run the test case of an entry of the store, and compare the results
+ * against the expected values recorded in the store. Only mismatching
+ * fields are printed, so an empty result indicates success.
+ */
+static int acvp_stored(int argc, char *argv[])
+{
+  const unsigned char *entry, *rec;
+  unsigned long idx;
+  uint64_t offset, len, t0;
+  char *end;
+
+  if (store_data == NULL || argc != 2)
+  {
+    goto stored_usage;
+  }
+
+  idx = strtoul(argv[1], &end, 10);
+  if (*argv[1] == '\0' || *end != '\0' || idx >= store_num_entries)
+  {
+    goto stored_usage;
+  }
+
+  entry = store_data + store_entries_offset + idx * STORE_ENTRY_BYTES;
+  if (entry[1] != MLKEM_K)
+  {
+    fprintf(stderr, "Entry %lu is not for MLKEM_K=%d\n", idx, MLKEM_K);
+    return (1);
+  }
+
+  len = load32_le(entry + 12);
+  offset = load64_le(entry + 16);
+  if (offset > store_len || len > store_len - offset)
+  {
+    goto invalid;
+  }
+  rec = store_data + offset;
+
+  switch (entry[0])
+  {
+    case store_keyGen:
+    {
+      unsigned char ek[MLKEM_INDCPA_PUBLICKEYBYTES];
+      unsigned char dk[MLKEM_SECRETKEYBYTES];
+      unsigned char zd[2 * MLKEM_SYMBYTES];
+
+      /* Record: z || d || ek || dk */
+      if (len != 2 * MLKEM_SYMBYTES + sizeof(ek) + sizeof(dk))
+      {
+        goto invalid;
+      }
+      memcpy(zd, rec + MLKEM_SYMBYTES, MLKEM_SYMBYTES);
+      memcpy(zd + MLKEM_SYMBYTES, rec, MLKEM_SYMBYTES);
+      rec += 2 * MLKEM_SYMBYTES;
+
+      t0 = now_ns();
+      crypto_kem_keypair_derand(ek, dk, zd);
+      compute_ns = now_ns() - t0;
+
+      check_field("ek", ek, rec, sizeof(ek));
+      check_field("dk", dk, rec + sizeof(ek), sizeof(dk));
+      break;
+    }
+    case store_encapsulation:
+    {
+      unsigned char ct[MLKEM_CIPHERTEXTBYTES];
+      unsigned char ss[MLKEM_SSBYTES];
+
+      /* Record: ek || m || c || k */
+      if (len != MLKEM_INDCPA_PUBLICKEYBYTES + MLKEM_SYMBYTES + sizeof(ct) +
+                     sizeof(ss))
+      {
+        goto invalid;
+      }
+
+      t0 = now_ns();
+      crypto_kem_enc_derand(ct, ss, rec, rec + MLKEM_INDCPA_PUBLICKEYBYTES);
+      compute_ns = now_ns() - t0;
+      rec += MLKEM_INDCPA_PUBLICKEYBYTES + MLKEM_SYMBYTES;
+
+      check_field("c", ct, rec, sizeof(ct));
+      check_field("k", ss, rec + sizeof(ct), sizeof(ss));
+      break;
+    }
+    case store_decapsulation:
+    {
+      unsigned char ss[MLKEM_SSBYTES];
+
+      /* Record: dk || c || k */
+      if (len != MLKEM_SECRETKEYBYTES + MLKEM_CIPHERTEXTBYTES + sizeof(ss))
+      {
+        goto invalid;
+      }
+
+      t0 = now_ns();
+      crypto_kem_dec(ss, rec + MLKEM_SECRETKEYBYTES, rec);
+      compute_ns = now_ns() - t0;
+      rec += MLKEM_SECRETKEYBYTES + MLKEM_CIPHERTEXTBYTES;
+
+      check_field("k", ss, rec, sizeof(ss));
+      break;
+    }
+    default:
+      goto invalid;
+  }
+
+  return (0);
+
+stored_usage:
+  fprintf(stderr, STORED_USAGE "\n");
+  return (1);
+
+invalid:
+  fprintf(stderr, "Entry %lu of ACVP store is invalid\n", idx);
+  return (1);
+}
+
+/*
+ * Batch mode: Process one request per line from stdin, terminating the
+ * output of each request with an empty line. This avoids spawning a new
+ * process for every test vector. If a store is given, requests may also
+ * refer to its entries via `stored ENTRY`.
+ *
+ * With timing enabled, an empty line is printed on startup to signal
+ * that the process is ready to accept requests.
+ */
+static int acvp_batch(void)
+{
+  static char line[MAX_LINE_LENGTH];
+  char *args[MAX_ARGS];
+  char *arg;
+  int nargs, rc;
+  size_t len;
+
+  if (report_time)
+  {
+    printf("\n");
+    fflush(stdout);
+  }
+
+  while (fgets(line, sizeof(line), stdin) != NULL)
+  {
+    len = strlen(line);
+    if (len > 0 && line[len - 1] != '\n' && !feof(stdin))
+    {
+      fprintf(stderr, "Request exceeds maximum length of %u characters\n",
+              (unsigned)(MAX_LINE_LENGTH - 2));
+      return (1);
+    }
+
+    nargs = 0;
+    for (arg = strtok(line, " \t\r\n"); arg != NULL;
+         arg = strtok(NULL, " \t\r\n"))
+    {
+      if (nargs == MAX_ARGS)
+      {
+        fprintf(stderr, USAGE "\n");
+        return (1);
+      }
+      args[nargs++] = arg;
+    }
+
+    /* Skip empty lines */
+    if (nargs == 0)
+    {
+      continue;
+    }
+
+    if (strcmp(args[0], "stored") == 0)
+    {
+      rc = acvp_stored(nargs, args);
+    }
+    else
+    {
+      rc = acvp_request(nargs, args);
+    }
+    if (rc != 0)
+    {
+      return rc;
+    }
+
+    if (report_time)
+    {
+      printf("time_ns=%lu\n", (unsigned long)compute_ns);
+    }
+    printf("\n");
+    fflush(stdout);
+  }
+
+  return (0);
+}
+
+int main(int argc, char *argv[])
+{
+  if (argc == 0)
+  {
+    fprintf(stderr, USAGE "\n");
+    return (1);
+  }
+  argc--, argv++;
+
+  if (argc > 0 && strcmp(*argv, "batch") == 0)
+  {
+    if (argc > 1 && strcmp(argv[1], "-t") == 0)
+    {
+      report_time = 1;
+      argc--, argv++;
+    }
+    if (argc > 2)
+    {
+      fprintf(stderr, BATCH_USAGE "\n");
+      return (1);
+    }
+    if (argc == 2 && store_open(argv[1]) != 0)
+    {
+      return (1);
+    }
+    return acvp_batch();
+  }
+
+  return acvp_request(argc, argv);
+}
@@ -0,0 +1,209 @@
+# Copyright (c) 2024 The mlkem-native project authors
+# SPDX-License-Identifier: Apache-2.0
+
+# Binary store for ACVP test vectors
+#
+# A store holds the test vectors of one or more internalProjection files
+# as raw bytes, together with an index that allows selecting subsets of
+# test cases without parsing or hex-decoding any JSON.
+#
+# Layout (all integers little endian):
+#
+# - Header:  magic "MLKACVP1", u32 #groups, u32 #entries,
+#            u64 offset of group table, u64 offset of entry table
+# - Records: Concatenated raw inputs and expected outputs of all test
+#            cases, see FIELDS
+# - Groups:  u8 mode, u8 function, u8 MLKEM_K, u8 reserved,
+#            u32 tgId, u32 index of first entry, u32 #entries
+# - Entries: u8 function, u8 MLKEM_K, u16 reserved, u32 tgId, u32 tcId,
+#            u32 record length, u64 record offset
+#
+# Groups are sorted by (mode, parameterSet, tgId), entries by
+# (mode, parameterSet, tgId, tcId). Every group refers to a contiguous
+# range of entries.
+#
+# The format is shared with `acvp_mlkem{lvl} batch STORE`, see
+# test/acvp_mlkem.c.
+
+import mmap
+import struct
+from bisect import bisect_left, bisect_right
+
+STORE_MAGIC = b"MLKACVP1"
+HEADER = struct.Struct("<8sIIQQ")
+GROUP = struct.Struct("<BBBxIII")
+ENTRY = struct.Struct("<BBxxIIIQ")
+
+MODES = ["encapDecap", "keyGen"]
+FUNCTIONS = ["keyGen", "encapsulation", "decapsulation"]
+PARAMETER_SETS = {"ML-KEM-512": 2, "ML-KEM-768": 3, "ML-KEM-1024": 4}
+
+# Inputs and expected outputs stored for each function, in record order
+FIELDS = {
+    "keyGen": (["z", "d"], ["ek", "dk"]),
+    "encapsulation": (["ek", "m"], ["c", "k"]),
+    "decapsulation": (["dk", "c"], ["k"]),
+}
+
+
+def field_length(k, field):
+    """Length in bytes of a field for parameter set MLKEM_K=k"""
+    if field in ["z", "d", "m", "k"]:
+        return 32
+    if field == "ek":
+        return 384 * k + 32
+    if field == "dk":
+        return 768 * k + 96
+    if field == "c":
+        return {2: 768, 3: 1088, 4: 1568}[k]
+    raise ValueError(f"Unknown field {field}")
+
+
+def group_function(mode, tg):
+    return "keyGen" if mode == "keyGen" else tg["function"]
+
+
+def write_store(path, groups):
+    """Write a store from an iterable of (mode, test group) pairs
+
+    Records are written as groups are consumed; only the index is
+    kept in memory."""
+    index = []
+    with open(path, "wb") as f:
+        f.write(b"\0" * HEADER.size)
+        offset = HEADER.size
+        for mode, tg in groups:
+            function = group_function(mode, tg)
+            k = PARAMETER_SETS[tg["parameterSet"]]
+            fields = FIELDS[function][0] + FIELDS[function][1]
+            for tc in tg["tests"]:
+                record = b"".join(
+                    bytes.fromhex(tc[x] if x in tc else tg[x]) for x in fields
+                )
+                f.write(record)
+                index.append(
+                    (
+                        MODES.index(mode),
+                        k,
+                        tg["tgId"],
+                        tc["tcId"],
+                        FUNCTIONS.index(function),
+                        len(record),
+                        offset,
+                    )
+                )
+                offset += len(record)
+
+        index.sort()
+        group_table = []
+        for i, (mode, k, tgId, _, function, _, _) in enumerate(index):
+            if group_table and group_table[-1][:4] == [mode, function, k, tgId]:
+                group_table[-1][5] += 1
+            else:
+                group_table.append([mode, function, k, tgId, i, 1])
+
+        groups_offset = offset
+        for g in group_table:
+            f.write(GROUP.pack(g[0], g[1], g[2], g[3], g[4], g[5]))
+        entries_offset = groups_offset + len(group_table) * GROUP.size
+        for mode, k, tgId, tcId, function, length, offset in index:
+            f.write(ENTRY.pack(function, k, tgId, tcId, length, offset))
+
+        f.seek(0)
+        f.write(
+            HEADER.pack(
+                STORE_MAGIC, len(group_table), len(index), groups_offset, entries_offset
+            )
+        )
+
+
+class Group:
+    def __init__(self, mode, function, k, tgId, first, count):
+        self.mode = MODES[mode]
+        self.function = FUNCTIONS[function]
+        self.k = k
+        self.parameterSet = [p for p, v in PARAMETER_SETS.items() if v == k][0]
+        self.tgId = tgId
+        self.first = first
+        self.count = count
+
+
+class Entry:
+    def __init__(self, index, group, tcId, length, offset):
+        self.index = index
+        self.group = group
+        self.tcId = tcId
+        self.length = length
+        self.offset = offset
+
+
+class _TcIds:
+    """Lazy sequence of the tcIds of a group, for bisection"""
+
+    def __init__(self, store, group):
+        self.store = store
+        self.group = group
+
+    def __len__(self):
+        return self.group.count
+
+    def __getitem__(self, i):
+        return self.store._unpack_entry(self.group.first + i)[3]
+
+
+class ACVPStore:
+    """Read-only, memory-mapped view of a store"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = HEADER.unpack_from(self.mm, 0)
+        (magic, num_groups, groups_offset) = (header[0], header[1], header[3])
+        (self.num_entries, self.entries_offset) = (header[2], header[4])
+        if magic != STORE_MAGIC:
+            raise ValueError(f"{path} is not an ACVP store")
+        self.groups = [
+            Group(*GROUP.unpack_from(self.mm, groups_offset + i * GROUP.size))
+            for i in range(num_groups)
+        ]
+
+    def _unpack_entry(self, i):
+        return ENTRY.unpack_from(self.mm, self.entries_offset + i * ENTRY.size)
+
+    def entry(self, i):
+        """Return the i-th entry of the index"""
+        g = self.groups[bisect_right([g.first for g in self.groups], i) - 1]
+        (_, _, _, tcId, length, offset) = self._unpack_entry(i)
+        return Entry(i, g, tcId, length, offset)
+
+    def select(self, modes=None, parameter_sets=None, tc_range=None):
+        """Yield entries matching the given modes, parameter sets and
+        inclusive tcId range, in the order of the index."""
+        for g in self.groups:
+            if modes is not None and g.mode not in modes:
+                continue
+            if parameter_sets is not None and g.parameterSet not in parameter_sets:
+                continue
+            (lo, hi) = (0, g.count)
+            if tc_range is not None:
+                tcIds = _TcIds(self, g)
+                lo = bisect_left(tcIds, tc_range[0])
+                hi = bisect_right(tcIds, tc_range[1])
+            for i in range(g.first + lo, g.first + hi):
+                (_, _, _, tcId, length, offset) = self._unpack_entry(i)
+                yield Entry(i, g, tcId, length, offset)
+
+    def field(self, entry, name):
+        """Return a field of the record of an entry as raw bytes"""
+        (inputs, outputs) = FIELDS[entry.group.function]
+        offset = entry.offset
+        for x in inputs + outputs:
+            n = field_length(entry.group.k, x)
+            if x == name:
+                return self.mm[offset : offset + n]
+            offset += n
+        raise ValueError(f"No field {name} for {entry.group.function}")
+
+    def close(self):
+        self.mm.close()
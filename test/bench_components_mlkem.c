@@ -28,29 +28,30 @@ static int cmp_uint64_t(const void *a, const void *b)
   return (int)((*((const uint64_t *)a)) - (*((const uint64_t *)b)));
 }
 
-#define BENCH(txt, code)                                \
-  for (i = 0; i < NTESTS; i++)                          \
-  {                                                     \
-    randombytes((uint8_t *)data0, sizeof(data0));       \
-    randombytes((uint8_t *)data1, sizeof(data1));       \
-    randombytes((uint8_t *)data2, sizeof(data2));       \
-    randombytes((uint8_t *)data3, sizeof(data3));       \
-    randombytes((uint8_t *)data4, sizeof(data4));       \
-    for (j = 0; j < NWARMUP; j++)                       \
-    {                                                   \
-      code;                                             \
-    }                                                   \
-                                                        \
-    t0 = get_cyclecounter();                            \
-    for (j = 0; j < NITERERATIONS; j++)                 \
-    {                                                   \
-      code;                                             \
-    }                                                   \
-    t1 = get_cyclecounter();                            \
-    (cyc)[i] = t1 - t0;                                 \
-  }                                                     \
-  qsort((cyc), NTESTS, sizeof(uint64_t), cmp_uint64_t); \
-  printf(txt " cycles=%" PRIu64 "\n", (cyc)[NTESTS >> 1] / NITERERATIONS);
+#define BENCH(txt, code)                                   \
+  for (i = 0; i < NTESTS; i++)                             \
+  {                                                        \
+    randombytes((uint8_t *)data0, sizeof(data0));          \
+    randombytes((uint8_t *)data1, sizeof(data1));          \
+    randombytes((uint8_t *)data2, sizeof(data2));          \
+    randombytes((uint8_t *)data3, sizeof(data3));          \
+    randombytes((uint8_t *)data4, sizeof(data4));          \
+    for (j = 0; j < NWARMUP; j++)                          \
+    {                                                      \
+      code;                                                \
+    }                                                      \
+                                                           \
+    t0 = get_cyclecounter();                               \
+    for (j = 0; j < NITERERATIONS; j++)                    \
+    {                                                      \
+      code;                                                \
+    }                                                      \
+    t1 = get_cyclecounter();                               \
+    (cyc)[i] = t1 - t0;                                    \
+  }                                                        \
+  qsort((cyc), NTESTS, sizeof(uint64_t), cmp_uint64_t);    \
+  printf(txt " %s=%" PRIu64 "\n", get_cyclecounter_unit(), \
+         (cyc)[NTESTS >> 1] / NITERERATIONS);
 
 static int bench(void)
 {
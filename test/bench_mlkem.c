@@ -2,27 +2,67 @@
  * Copyright (c) 2024 The mlkem-native project authors
  * SPDX-License-Identifier: Apache-2.0
  */
+#if defined(__linux__)
+#if !defined(_GNU_SOURCE)
+/* Ensure that pthread_setaffinity_np() and clock_gettime() are declared
+ * even when compiling with -std=c99 */
+#define _GNU_SOURCE
+#endif
+#endif
+
 #include <inttypes.h>
+#include <math.h>
+#include <pthread.h>
 #include <stddef.h>
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
+#include <time.h>
+#include <unistd.h>
 #include "hal.h"
 #include "kem.h"
 #include "randombytes.h"
 
+/* Defaults, see USAGE */
 #define NWARMUP 50
 #define NITERATIONS 300
 #define NTESTS 500
 
+#define USAGE                                                              \
+  "bench_mlkem{lvl} [-w WARMUP] [-i ITERATIONS] [-n SAMPLES] [-r] [-c]\n"  \
+  "bench_mlkem{lvl} -t THREADS [-a] [-w WARMUP] [-i ITERATIONS]\n"         \
+  "  -r: print every sample\n"                                             \
+  "  -c: estimate cycles when timing in ns (CYCLES=NO), see hal.h\n"       \
+  "  -t: measure throughput with 1 up to THREADS threads (0: all CPUs)\n"  \
+  "  -a: pin thread i to CPU i (Linux only)"
+
+static unsigned long nwarmup = NWARMUP;
+static unsigned long niterations = NITERATIONS;
+static unsigned long ntests = NTESTS;
+/* Whether to print the cycles per iteration of every sample, see -r */
+static int print_raw = 0;
+/* Whether to estimate the cycles per unit of get_cyclecounter(), see -c */
+static int calibrate = 0;
+
+/* Unit of the measurements, and the estimated cycles per unit, or 0 */
+static const char *unit = "cycles";
+static double cycles_per_unit = 0;
+
 static int cmp_uint64_t(const void *a, const void *b)
 {
-  return (int)((*((const uint64_t *)a)) - (*((const uint64_t *)b)));
+  uint64_t x = *(const uint64_t *)a, y = *(const uint64_t *)b;
+  return (x > y) - (x < y);
 }
 
-static void print_median(const char *txt, uint64_t cyc[NTESTS])
+static void print_median(const char *txt, const uint64_t *cyc)
 {
-  printf("%10s cycles = %" PRIu64 "\n", txt, cyc[NTESTS >> 1] / NITERATIONS);
+  uint64_t median = cyc[ntests >> 1] / niterations;
+  printf("%10s %s = %" PRIu64 "\n", txt, unit, median);
+  if (cycles_per_unit > 0)
+  {
+    printf("%10s est. cycles = %" PRIu64 "\n", txt,
+           (uint64_t)((double)median * cycles_per_unit + 0.5));
+  }
 }
 
 static int percentiles[] = {1, 10, 20, 30, 40, 50, 60, 70, 80, 90, 99};
@@ -36,15 +76,66 @@ static void print_percentile_legend(void)
   printf("\n");
 }
 
-static void print_percentiles(const char *txt, uint64_t cyc[NTESTS])
+static void print_percentiles(const char *txt, const uint64_t *cyc)
 {
   unsigned i;
   printf("%10s percentiles:", txt);
   for (i = 0; i < sizeof(percentiles) / sizeof(percentiles[0]); i++)
-    printf("%7" PRIu64, (cyc)[NTESTS * percentiles[i] / 100] / NITERATIONS);
+    printf("%7" PRIu64, (cyc)[ntests * percentiles[i] / 100] / niterations);
   printf("\n");
 }
 
+static void print_samples(const char *txt, const uint64_t *cyc)
+{
+  unsigned long i;
+  printf("%10s samples:", txt);
+  for (i = 0; i < ntests; i++)
+    printf(" %" PRIu64, cyc[i] / niterations);
+  printf("\n");
+}
+
+static void print_statistics_legend(void)
+{
+  printf("%22s%10s%10s%10s%10s%10s\n", "statistic", "median", "mean", "stddev",
+         "min", "MAD");
+}
+
+/*
+ * Print the median, mean, sample standard deviation, minimum and median
+ * absolute deviation from the median of the cycles per iteration of the
+ * sorted samples `cyc`. `dev` is scratch space for `ntests` samples.
+ */
+static void print_statistics(const char *txt, const uint64_t *cyc,
+                             uint64_t *dev)
+{
+  unsigned long i;
+  uint64_t median = cyc[ntests >> 1] / niterations, x;
+  double mean = 0, var = 0, d;
+
+  for (i = 0; i < ntests; i++)
+  {
+    mean += (double)cyc[i] / niterations;
+  }
+  mean /= ntests;
+
+  for (i = 0; i < ntests; i++)
+  {
+    d = (double)cyc[i] / niterations - mean;
+    var += d * d;
+    x = cyc[i] / niterations;
+    dev[i] = x > median ? x - median : median - x;
+  }
+  if (ntests > 1)
+  {
+    var /= ntests - 1;
+  }
+  qsort(dev, ntests, sizeof(uint64_t), cmp_uint64_t);
+
+  printf("%10s statistics:%10" PRIu64 "%10.1f%10.1f%10" PRIu64 "%10" PRIu64
+         "\n",
+         txt, median, mean, sqrt(var), cyc[0] / niterations, dev[ntests >> 1]);
+}
+
 static int bench(void)
 {
   uint8_t pk[CRYPTO_PUBLICKEYBYTES];
@@ -53,25 +144,48 @@ static int bench(void)
   uint8_t key_a[CRYPTO_BYTES];
   uint8_t key_b[CRYPTO_BYTES];
   unsigned char kg_rand[2 * CRYPTO_BYTES], enc_rand[CRYPTO_BYTES];
-  uint64_t cycles_kg[NTESTS], cycles_enc[NTESTS], cycles_dec[NTESTS];
+  uint64_t *cycles_kg, *cycles_enc, *cycles_dec, *dev;
 
-  unsigned int i, j;
+  unsigned long i, j;
   uint64_t t0, t1;
 
+  cycles_kg = malloc(4 * ntests * sizeof(uint64_t));
+  if (cycles_kg == NULL)
+  {
+    fprintf(stderr, "ERROR out of memory\n");
+    return 1;
+  }
+  cycles_enc = cycles_kg + ntests;
+  cycles_dec = cycles_enc + ntests;
+  dev = cycles_dec + ntests;
+
+  unit = get_cyclecounter_unit();
+  if (calibrate && strcmp(unit, "cycles") != 0)
+  {
+    cycles_per_unit = calibrate_cyclecounter();
+  }
+  printf("unit %s", unit);
+  if (cycles_per_unit > 0)
+  {
+    printf(", %.4f estimated cycles per %s", cycles_per_unit, unit);
+  }
+  printf("\n");
+  printf("warmup %lu, iterations %lu, samples %lu\n\n", nwarmup, niterations,
+         ntests);
 
-  for (i = 0; i < NTESTS; i++)
+  for (i = 0; i < ntests; i++)
   {
     randombytes(kg_rand, 2 * CRYPTO_BYTES);
     randombytes(enc_rand, CRYPTO_BYTES);
 
     /* Key-pair generation */
-    for (j = 0; j < NWARMUP; j++)
+    for (j = 0; j < nwarmup; j++)
     {
       crypto_kem_keypair_derand(pk, sk, kg_rand);
     }
 
     t0 = get_cyclecounter();
-    for (j = 0; j < NITERATIONS; j++)
+    for (j = 0; j < niterations; j++)
     {
       crypto_kem_keypair_derand(pk, sk, kg_rand);
     }
@@ -80,12 +194,12 @@ static int bench(void)
 
 
     /* Encapsulation */
-    for (j = 0; j < NWARMUP; j++)
+    for (j = 0; j < nwarmup; j++)
     {
       crypto_kem_enc_derand(ct, key_a, pk, enc_rand);
     }
     t0 = get_cyclecounter();
-    for (j = 0; j < NITERATIONS; j++)
+    for (j = 0; j < niterations; j++)
     {
       crypto_kem_enc_derand(ct, key_a, pk, enc_rand);
     }
@@ -93,12 +207,12 @@ static int bench(void)
     cycles_enc[i] = t1 - t0;
 
     /* Decapsulation */
-    for (j = 0; j < NWARMUP; j++)
+    for (j = 0; j < nwarmup; j++)
     {
       crypto_kem_dec(key_b, ct, sk);
     }
     t0 = get_cyclecounter();
-    for (j = 0; j < NITERATIONS; j++)
+    for (j = 0; j < niterations; j++)
     {
       crypto_kem_dec(key_b, ct, sk);
     }
@@ -109,13 +223,14 @@ static int bench(void)
     if (memcmp(key_a, key_b, CRYPTO_BYTES))
     {
       printf("ERROR keys\n");
+      free(cycles_kg);
       return 1;
     }
   }
 
-  qsort(cycles_kg, NTESTS, sizeof(uint64_t), cmp_uint64_t);
-  qsort(cycles_enc, NTESTS, sizeof(uint64_t), cmp_uint64_t);
-  qsort(cycles_dec, NTESTS, sizeof(uint64_t), cmp_uint64_t);
+  qsort(cycles_kg, ntests, sizeof(uint64_t), cmp_uint64_t);
+  qsort(cycles_enc, ntests, sizeof(uint64_t), cmp_uint64_t);
+  qsort(cycles_dec, ntests, sizeof(uint64_t), cmp_uint64_t);
 
   print_median("keypair", cycles_kg);
   print_median("encaps", cycles_enc);
@@ -129,14 +244,372 @@ static int bench(void)
   print_percentiles("encaps", cycles_enc);
   print_percentiles("decaps", cycles_dec);
 
+  printf("\n");
+
+  print_statistics_legend();
+
+  print_statistics("keypair", cycles_kg, dev);
+  print_statistics("encaps", cycles_enc, dev);
+  print_statistics("decaps", cycles_dec, dev);
+
+  if (print_raw)
+  {
+    printf("\n");
+    print_samples("keypair", cycles_kg);
+    print_samples("encaps", cycles_enc);
+    print_samples("decaps", cycles_dec);
+  }
+
+  free(cycles_kg);
   return 0;
 }
 
-int main(void)
+/*
+ * Throughput mode, see -t
+ *
+ * Every primitive is run by 1 up to the given number of threads at once.
+ * The threads first run the warm-up operations, and then wait for each
+ * other, so that the timed operations of all of them overlap.
+ */
+
+enum primitive
+{
+  KEYPAIR,
+  ENCAPS,
+  DECAPS
+};
+
+static const char *primitive_names[] = {"keypair", "encaps", "decaps"};
+
+struct gate
+{
+  pthread_mutex_t lock;
+  pthread_cond_t cond;
+  unsigned long ready;
+  int open;
+};
+
+struct worker
+{
+  pthread_t thread;
+  struct gate *gate;
+  unsigned long index;
+  enum primitive primitive;
+  int pin;
+  uint64_t end;
+  int err;
+};
+
+static uint64_t wall_ns(void)
+{
+  struct timespec ts;
+  clock_gettime(CLOCK_MONOTONIC, &ts);
+  return (uint64_t)ts.tv_sec * 1000000000u + (uint64_t)ts.tv_nsec;
+}
+
+static int pin_thread(unsigned long index)
 {
+#if defined(__linux__)
+  cpu_set_t cpus;
+  long ncpus = sysconf(_SC_NPROCESSORS_ONLN);
+  CPU_ZERO(&cpus);
+  CPU_SET(index % (unsigned long)(ncpus > 0 ? ncpus : 1), &cpus);
+  return pthread_setaffinity_np(pthread_self(), sizeof(cpus), &cpus);
+#else
+  (void)index;
+  return 1;
+#endif
+}
+
+static void run_primitive(enum primitive p, uint8_t *pk, uint8_t *sk,
+                          uint8_t *ct, uint8_t *key, const uint8_t *kg_rand,
+                          const uint8_t *enc_rand)
+{
+  switch (p)
+  {
+    case KEYPAIR:
+      crypto_kem_keypair_derand(pk, sk, kg_rand);
+      break;
+    case ENCAPS:
+      crypto_kem_enc_derand(ct, key, pk, enc_rand);
+      break;
+    case DECAPS:
+      crypto_kem_dec(key, ct, sk);
+      break;
+  }
+}
+
+static void *worker_run(void *arg)
+{
+  struct worker *w = (struct worker *)arg;
+  uint8_t pk[CRYPTO_PUBLICKEYBYTES];
+  uint8_t sk[CRYPTO_SECRETKEYBYTES];
+  uint8_t ct[CRYPTO_CIPHERTEXTBYTES];
+  uint8_t key_a[CRYPTO_BYTES];
+  uint8_t key_b[CRYPTO_BYTES];
+  uint8_t kg_rand[2 * CRYPTO_BYTES], enc_rand[CRYPTO_BYTES];
+  unsigned long j;
+
+  if (w->pin && pin_thread(w->index) != 0)
+  {
+    w->err = 1;
+  }
+
+  /* randombytes() is not thread-safe, so derive the randomness from the
+   * index of the thread instead */
+  memset(kg_rand, (int)(w->index & 0xff), sizeof(kg_rand));
+  memset(enc_rand, (int)(~w->index & 0xff), sizeof(enc_rand));
+  crypto_kem_keypair_derand(pk, sk, kg_rand);
+  crypto_kem_enc_derand(ct, key_a, pk, enc_rand);
+
+  for (j = 0; j < nwarmup; j++)
+  {
+    run_primitive(w->primitive, pk, sk, ct, key_b, kg_rand, enc_rand);
+  }
+
+  pthread_mutex_lock(&w->gate->lock);
+  w->gate->ready++;
+  pthread_cond_broadcast(&w->gate->cond);
+  while (!w->gate->open)
+  {
+    pthread_cond_wait(&w->gate->cond, &w->gate->lock);
+  }
+  pthread_mutex_unlock(&w->gate->lock);
+
+  for (j = 0; j < niterations; j++)
+  {
+    run_primitive(w->primitive, pk, sk, ct, key_b, kg_rand, enc_rand);
+  }
+  w->end = wall_ns();
+
+  if (w->primitive == DECAPS && memcmp(key_a, key_b, CRYPTO_BYTES))
+  {
+    w->err = 1;
+  }
+  return NULL;
+}
+
+/*
+ * Run `primitive` on `nthreads` threads at once, and return the number of
+ * operations per second of all of them in `ops`
+ */
+static int run_threads(struct worker *workers, unsigned long nthreads,
+                       enum primitive primitive, int pin, double *ops)
+{
+  struct gate gate;
+  unsigned long i, started;
+  uint64_t start, end = 0;
+  int rc = 0;
+
+  pthread_mutex_init(&gate.lock, NULL);
+  pthread_cond_init(&gate.cond, NULL);
+  gate.ready = 0;
+  gate.open = 0;
+
+  for (started = 0; started < nthreads; started++)
+  {
+    workers[started].gate = &gate;
+    workers[started].index = started;
+    workers[started].primitive = primitive;
+    workers[started].pin = pin;
+    workers[started].err = 0;
+    if (pthread_create(&workers[started].thread, NULL, worker_run,
+                       &workers[started]) != 0)
+    {
+      fprintf(stderr, "ERROR creating thread %lu\n", started);
+      rc = 1;
+      break;
+    }
+  }
+
+  /* Start the timed operations once all threads have warmed up */
+  pthread_mutex_lock(&gate.lock);
+  while (gate.ready < started)
+  {
+    pthread_cond_wait(&gate.cond, &gate.lock);
+  }
+  gate.open = 1;
+  start = wall_ns();
+  pthread_cond_broadcast(&gate.cond);
+  pthread_mutex_unlock(&gate.lock);
+
+  for (i = 0; i < started; i++)
+  {
+    pthread_join(workers[i].thread, NULL);
+    if (workers[i].end > end)
+    {
+      end = workers[i].end;
+    }
+    if (workers[i].err)
+    {
+      fprintf(stderr, "ERROR in thread %lu (%s%s)\n", i,
+              primitive_names[primitive], pin ? ", pinned" : "");
+      rc = 1;
+    }
+  }
+
+  pthread_cond_destroy(&gate.cond);
+  pthread_mutex_destroy(&gate.lock);
+
+  /* No throughput if not all threads could be started or succeeded */
+  *ops = 0;
+  if (rc == 0)
+  {
+    *ops = (double)started * (double)niterations * 1e9 / (double)(end - start);
+  }
+  return rc;
+}
+
+/*
+ * Print the number of operations per second of every primitive for 1 up
+ * to `max_threads` threads, and the scaling efficiency: the throughput
+ * relative to that of a single thread times the number of threads
+ */
+static int bench_throughput(unsigned long max_threads, int pin)
+{
+  struct worker *workers;
+  double ops, ops1[3];
+  unsigned long n;
+  int p;
+
+  workers = malloc(max_threads * sizeof(struct worker));
+  if (workers == NULL)
+  {
+    fprintf(stderr, "ERROR out of memory\n");
+    return 1;
+  }
+
+  printf("warmup %lu, iterations %lu per thread%s\n\n", nwarmup, niterations,
+         pin ? ", pinned" : "");
+  printf("%10s", "threads");
+  for (p = KEYPAIR; p <= DECAPS; p++)
+  {
+    printf("%10s ops/s%8s", primitive_names[p], "eff.");
+  }
+  printf("\n");
+
+  for (n = 1; n <= max_threads; n++)
+  {
+    printf("%10lu", n);
+    for (p = KEYPAIR; p <= DECAPS; p++)
+    {
+      if (run_threads(workers, n, (enum primitive)p, pin, &ops) != 0)
+      {
+        free(workers);
+        return 1;
+      }
+      if (n == 1)
+      {
+        ops1[p] = ops;
+      }
+      printf("%16.0f%7.1f%%", ops, 100 * ops / ((double)n * ops1[p]));
+    }
+    printf("\n");
+    fflush(stdout);
+  }
+
+  free(workers);
+  return 0;
+}
+
+/* Parse the value of option `opt`, which must be at least `min` */
+static int parse_count(const char *opt, const char *s, unsigned long min,
+                       unsigned long *count)
+{
+  char *end;
+  if (s == NULL || *s < '0' || *s > '9')
+  {
+    goto parse_count_error;
+  }
+  *count = strtoul(s, &end, 10);
+  if (*end != '\0' || *count < min)
+  {
+    goto parse_count_error;
+  }
+  return 0;
+
+parse_count_error:
+  fprintf(stderr, "Invalid value for %s, expecting an integer >= %lu\n", opt,
+          min);
+  return 1;
+}
+
+int main(int argc, char *argv[])
+{
+  int rc;
+  int i;
+  /* Throughput mode, see -t and -a */
+  int throughput = 0, pin = 0;
+  unsigned long nthreads = 0;
+  /* Whether -n was given */
+  int samples = 0;
+
+  for (i = 1; i < argc; i++)
+  {
+    if (strcmp(argv[i], "-w") == 0)
+    {
+      rc = parse_count("-w", argv[++i], 0, &nwarmup);
+    }
+    else if (strcmp(argv[i], "-i") == 0)
+    {
+      rc = parse_count("-i", argv[++i], 1, &niterations);
+    }
+    else if (strcmp(argv[i], "-n") == 0)
+    {
+      rc = parse_count("-n", argv[++i], 1, &ntests);
+      samples = 1;
+    }
+    else if (strcmp(argv[i], "-r") == 0)
+    {
+      print_raw = 1;
+      rc = 0;
+    }
+    else if (strcmp(argv[i], "-c") == 0)
+    {
+      calibrate = 1;
+      rc = 0;
+    }
+    else if (strcmp(argv[i], "-t") == 0)
+    {
+      throughput = 1;
+      rc = parse_count("-t", argv[++i], 0, &nthreads);
+    }
+    else if (strcmp(argv[i], "-a") == 0)
+    {
+      pin = 1;
+      rc = 0;
+    }
+    else
+    {
+      rc = 1;
+    }
+    if (rc != 0)
+    {
+      fprintf(stderr, USAGE "\n");
+      return 1;
+    }
+  }
+
+  /* -n, -r and -c only apply to latencies, and -a only to throughput */
+  if (throughput ? (samples || print_raw || calibrate) : pin)
+  {
+    fprintf(stderr, USAGE "\n");
+    return 1;
+  }
+
+  if (throughput)
+  {
+    if (nthreads == 0)
+    {
+      long ncpus = sysconf(_SC_NPROCESSORS_ONLN);
+      nthreads = ncpus > 0 ? (unsigned long)ncpus : 1;
+    }
+    return bench_throughput(nthreads, pin);
+  }
+
   enable_cyclecounter();
-  bench();
+  rc = bench();
   disable_cyclecounter();
 
-  return 0;
+  return rc;
 }
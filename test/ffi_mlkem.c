@@ -0,0 +1,44 @@
+/*
+ * Copyright (c) 2024 The mlkem-native project authors
+ * SPDX-License-Identifier: Apache-2.0
+ */
+
+/*
+ * Stable entry points for lib<scheme>.so, which is loaded from Python
+ * via scripts/lib/mlkem_ffi.py. The symbols of the KEM API itself are
+ * namespaced by parameter set and backend, so are not known upfront.
+ */
+
+#include <stddef.h>
+#include <stdint.h>
+#include "kem.h"
+
+size_t mlkem_ffi_publickeybytes(void);
+size_t mlkem_ffi_secretkeybytes(void);
+size_t mlkem_ffi_ciphertextbytes(void);
+size_t mlkem_ffi_bytes(void);
+int mlkem_ffi_keypair_derand(uint8_t *pk, uint8_t *sk, const uint8_t *coins);
+int mlkem_ffi_enc_derand(uint8_t *ct, uint8_t *ss, const uint8_t *pk,
+                         const uint8_t *coins);
+int mlkem_ffi_dec(uint8_t *ss, const uint8_t *ct, const uint8_t *sk);
+
+size_t mlkem_ffi_publickeybytes(void) { return CRYPTO_PUBLICKEYBYTES; }
+size_t mlkem_ffi_secretkeybytes(void) { return CRYPTO_SECRETKEYBYTES; }
+size_t mlkem_ffi_ciphertextbytes(void) { return CRYPTO_CIPHERTEXTBYTES; }
+size_t mlkem_ffi_bytes(void) { return CRYPTO_BYTES; }
+
+int mlkem_ffi_keypair_derand(uint8_t *pk, uint8_t *sk, const uint8_t *coins)
+{
+  return crypto_kem_keypair_derand(pk, sk, coins);
+}
+
+int mlkem_ffi_enc_derand(uint8_t *ct, uint8_t *ss, const uint8_t *pk,
+                         const uint8_t *coins)
+{
+  return crypto_kem_enc_derand(ct, ss, pk, coins);
+}
+
+int mlkem_ffi_dec(uint8_t *ss, const uint8_t *ct, const uint8_t *sk)
+{
+  return crypto_kem_dec(ss, ct, sk);
+}
@@ -298,8 +298,80 @@ uint64_t get_cyclecounter(void)
 
 #else
 
+/*
+ * Without a cycle counter, fall back to a monotonic clock. Where available,
+ * CLOCK_MONOTONIC_RAW is used, which, unlike CLOCK_MONOTONIC, is not
+ * subject to NTP frequency adjustments.
+ */
+
+#include <time.h>
+
+#if defined(CLOCK_MONOTONIC_RAW)
+#define HAL_CLOCK CLOCK_MONOTONIC_RAW
+#else
+#define HAL_CLOCK CLOCK_MONOTONIC
+#endif
+
+/* Duration of calibrate_cyclecounter() */
+#define CALIBRATION_NS 100000000u
+
 void enable_cyclecounter(void) { return; }
 void disable_cyclecounter(void) { return; }
-uint64_t get_cyclecounter(void) { return (0); }
+
+uint64_t get_cyclecounter(void)
+{
+  struct timespec ts;
+  clock_gettime(HAL_CLOCK, &ts);
+  return (uint64_t)ts.tv_sec * 1000000000u + (uint64_t)ts.tv_nsec;
+}
+
+const char *get_cyclecounter_unit(void) { return "ns"; }
+
+#if defined(__x86_64__)
+
+static uint64_t rdtsc(void)
+{
+  uint64_t result;
+
+  __asm__ volatile("rdtsc; shlq $32,%%rdx; orq %%rdx,%%rax"
+                   : "=a"(result)
+                   :
+                   : "%rdx");
+
+  return result;
+}
+
+/*
+ * On CPUs with an invariant TSC, the TSC runs at a fixed reference
+ * frequency, which may differ from the actual core frequency, so this is
+ * an estimate only.
+ */
+double calibrate_cyclecounter(void)
+{
+  uint64_t t0, t1, c0, c1;
+
+  t0 = get_cyclecounter();
+  c0 = rdtsc();
+  do
+  {
+    t1 = get_cyclecounter();
+  } while (t1 - t0 < CALIBRATION_NS);
+  c1 = rdtsc();
+
+  return (double)(c1 - c0) / (double)(t1 - t0);
+}
+
+#else
+
+double calibrate_cyclecounter(void) { return 0; }
+
+#endif
+
+#endif
+
+#if defined(PMU_CYCLES) || defined(PERF_CYCLES) || defined(M1_CYCLES)
+
+const char *get_cyclecounter_unit(void) { return "cycles"; }
+double calibrate_cyclecounter(void) { return 1; }
 
 #endif
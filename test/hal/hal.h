@@ -31,4 +31,18 @@ void enable_cyclecounter(void);
 void disable_cyclecounter(void);
 uint64_t get_cyclecounter(void);
 
+/*
+ * Unit of the values of get_cyclecounter(): "cycles", or "ns" without a
+ * cycle counter (CYCLES=NO), in which case the time of a monotonic clock
+ * is returned instead.
+ */
+const char *get_cyclecounter_unit(void);
+
+/*
+ * Estimate the number of CPU cycles per unit of get_cyclecounter(), by
+ * comparing it against the time stamp counter for a while. Returns 0 if
+ * no such estimate is available; only x86_64 has a time stamp counter.
+ */
+double calibrate_cyclecounter(void);
+
 #endif
@@ -0,0 +1,201 @@
+# Copyright (c) 2024 The mlkem-native project authors
+# SPDX-License-Identifier: Apache-2.0
+
+#
+# Checks of the self-contained logic of the test scripts: the binary
+# ACVP store, the Mann-Whitney U test of bench-compare, the partitioning
+# of --shard and the KAT chunk digests.
+#
+# Run as `python3 test/test_scripts.py`.
+#
+
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ACVP_DATA = os.path.join(ROOT, "test", "acvp_data")
+sys.path.append(os.path.join(ROOT, "scripts", "lib"))
+
+import bench
+from acvp_store import FIELDS, MODES, ACVPStore, group_function, write_store
+from acvp_vectors import iter_test_groups, json_files, tc_ids
+from shard import Unit, acvp_ranges, partition
+from util import KATDigests
+
+
+def json_groups():
+    """(mode, test group) of all test vectors in test/acvp_data"""
+    for mode in MODES:
+        for tg in iter_test_groups(os.path.join(ACVP_DATA, json_files[mode])):
+            yield (mode, tg)
+
+
+class TestACVPStore(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "acvp.store")
+        write_store(self.path, json_groups())
+        self.store = ACVPStore(self.path)
+
+    def tearDown(self):
+        self.store.close()
+        self.dir.cleanup()
+
+    def test_roundtrip(self):
+        """Every field of every test case reads back as in the JSON files"""
+        entries = {
+            (e.group.mode, e.group.parameterSet, e.group.tgId, e.tcId): e
+            for e in self.store.select()
+        }
+        n = 0
+        for mode, tg in json_groups():
+            (inputs, outputs) = FIELDS[group_function(mode, tg)]
+            for tc in tg["tests"]:
+                e = entries[(mode, tg["parameterSet"], tg["tgId"], tc["tcId"])]
+                for f in inputs + outputs:
+                    expect = tc[f] if f in tc else tg[f]
+                    self.assertEqual(self.store.field(e, f).hex(), expect.lower())
+                n += 1
+        self.assertEqual(n, len(entries))
+        self.assertEqual(n, self.store.num_entries)
+
+    def test_select(self):
+        """Selection by mode, parameter set and tcId range matches the
+        JSON files"""
+        selected = self.store.select(["keyGen"], ["ML-KEM-768"], (10, 20))
+        expect = [
+            tc["tcId"]
+            for mode, tg in json_groups()
+            if mode == "keyGen" and tg["parameterSet"] == "ML-KEM-768"
+            for tc in tg["tests"]
+            if 10 <= tc["tcId"] <= 20
+        ]
+        self.assertEqual([e.tcId for e in selected], sorted(expect))
+
+
+class TestMannWhitney(unittest.TestCase):
+
+    def test_separated(self):
+        # All of ys exceed all of xs: U = 25, mean 12.5, variance 275/12,
+        # z = (25 - 12.5 - 0.5) / sqrt(275/12)
+        p = bench.mann_whitney([1, 2, 3, 4, 5], [6, 7, 8, 9, 10])
+        self.assertAlmostEqual(p, 0.0060928902, places=9)
+        # ... and the other way round: U = 0,
+        # z = (0 - 12.5 - 0.5) / sqrt(275/12)
+        p = bench.mann_whitney([6, 7, 8, 9, 10], [1, 2, 3, 4, 5])
+        self.assertAlmostEqual(p, 0.9966923245, places=9)
+
+    def test_ties(self):
+        # Rank sum of ys 60.5, so U = 60.5 - 7 * 8 / 2 = 32.5, mean 21;
+        # tie groups of sizes 3, 2, 3, 2 give a variance of
+        # 42 / 12 * (14 - 60 / (13 * 12))
+        p = bench.mann_whitney([1, 2, 2, 3, 5, 8], [2, 3, 5, 5, 9, 9, 12])
+        self.assertAlmostEqual(p, 0.0555274729, places=9)
+
+    def test_identical(self):
+        self.assertEqual(bench.mann_whitney([5] * 4, [5] * 4), 1.0)
+
+    def test_compare(self):
+        def results(median, samples):
+            r = {
+                "benchmark": "kem",
+                "scheme": "ML-KEM-512",
+                "opt": "opt",
+                "name": "keypair",
+                "unit": "cycles",
+                "median": median,
+            }
+            if samples is not None:
+                r["samples"] = samples
+            return {"version": bench.VERSION, "results": [r]}
+
+        base = results(100, [98, 99, 100, 101, 102])
+        slow = results(110, [108, 109, 110, 111, 112])
+        noisy = results(110, [60, 99, 110, 101, 150])
+        [row] = bench.compare(base, slow, 0.05, 0.05)
+        self.assertEqual(row[-1], "regression")
+        [row] = bench.compare(slow, base, 0.05, 0.05)
+        self.assertEqual(row[-1], "improvement")
+        # Not significant
+        [row] = bench.compare(base, noisy, 0.05, 0.05)
+        self.assertEqual(row[-1], "unchanged")
+        # Below the threshold
+        [row] = bench.compare(base, slow, 0.2, 0.05)
+        self.assertEqual(row[-1], "unchanged")
+        # Without samples, the change alone decides
+        [row] = bench.compare(results(100, None), results(110, None), 0.05, 0.05)
+        self.assertEqual((row[4], row[-1]), (None, "regression"))
+
+
+class TestShard(unittest.TestCase):
+
+    def test_acvp_ranges(self):
+        """Every ACVP test case is in exactly one range"""
+        ids = tc_ids(ACVP_DATA)
+        ranges = acvp_ranges(ACVP_DATA)
+        self.assertEqual(set(ranges), set(ids))
+        for k, rs in ranges.items():
+            self.assertEqual(sum(n for _, _, n in rs), len(ids[k]))
+            for tcId in ids[k]:
+                self.assertEqual(sum(1 for lo, hi, _ in rs if lo <= tcId <= hi), 1)
+
+    def test_partition(self):
+        """Every unit is in exactly one shard, for any number of shards"""
+        ranges = acvp_ranges(ACVP_DATA)
+        vectors = {}
+        units = []
+        for (param, mode), rs in ranges.items():
+            vectors[param] = vectors.get(param, 0) + sum(n for _, _, n in rs)
+            units += [Unit("ACVP", "opt", param, mode, (lo, hi), n) for lo, hi, n in rs]
+        units += [Unit("KAT", "opt", param) for param in vectors]
+        keys = [u.key() for u in units]
+        self.assertEqual(len(set(keys)), len(keys))
+        timings = {
+            ("KAT", "opt", "ML-KEM-512"): 3.0,
+            ("ACVP", "opt", "ML-KEM-768"): 2.0,
+        }
+        for n in [1, 2, 3, 7, len(units) + 1]:
+            shards = partition(units, n, timings, vectors)
+            self.assertEqual(len(shards), n)
+            self.assertEqual(sorted(k for s in shards for k in s), sorted(keys))
+            # Deterministic
+            self.assertEqual(shards, partition(units, n, timings, vectors))
+
+
+class TestKATDigests(unittest.TestCase):
+
+    @staticmethod
+    def kat(vectors, changed=None):
+        """Digests of KAT output with `vectors` vectors, where the field ct
+        of vector `changed` differs"""
+        d = KATDigests(10)
+        d.write(b"# comment\n")
+        for i in range(vectors):
+            ct = "ff" if i == changed else f"{i:02x}"
+            # Split writes across lines
+            d.write(f"pk = {i:02x}\nsk = {i:02x}\nct = ".encode())
+            d.write(f"{ct}\nss = {i:02x}\n".encode())
+        return d
+
+    def test_match(self):
+        expect = self.kat(35).digests()
+        self.assertEqual(expect["fields"], ["pk", "sk", "ct", "ss"])
+        self.assertEqual(len(expect["sha256"]), 4)
+        self.assertIsNone(self.kat(35).first_divergence(expect))
+
+    def test_divergence(self):
+        expect = self.kat(35).digests()
+        self.assertEqual(self.kat(35, 23).first_divergence(expect), (20, 29, "ct"))
+        # Missing chunk, and truncated chunk
+        self.assertEqual(self.kat(30).first_divergence(expect), (30, 39, None))
+        self.assertEqual(self.kat(25).first_divergence(expect), (20, 29, "pk"))
+        # Extra chunk
+        expect = self.kat(30).digests()
+        self.assertEqual(self.kat(35).first_divergence(expect), (30, 39, None))
+
+
+if __name__ == "__main__":
+    unittest.main()